@@ -0,0 +1,184 @@
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Set
+
+DEFAULT_DB_PATH = os.path.join("data", "dividends.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dividends (
+    account_id TEXT NOT NULL DEFAULT '',
+    ticker TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    ex_date TEXT NOT NULL,
+    pay_date TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    gross REAL NOT NULL,
+    tax REAL NOT NULL,
+    fee REAL NOT NULL,
+    net REAL NOT NULL,
+    fx_rate REAL NOT NULL,
+    description TEXT NOT NULL,
+    UNIQUE (account_id, ticker, fecha, ex_date, pay_date, currency, gross, description)
+);
+CREATE INDEX IF NOT EXISTS idx_dividends_ticker_pay_date ON dividends (ticker, pay_date);
+
+CREATE TABLE IF NOT EXISTS dividend_calendar (
+    ticker TEXT PRIMARY KEY,
+    frequency TEXT NOT NULL,
+    payments_per_year INTEGER NOT NULL,
+    payments_seen INTEGER NOT NULL,
+    last_ex_date TEXT NOT NULL,
+    last_pay_date TEXT NOT NULL,
+    last_amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    description TEXT NOT NULL,
+    next_ex_date TEXT,
+    next_pay_date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_calendar_next_pay_date ON dividend_calendar (next_pay_date);
+"""
+
+
+def _iso_date(value: str) -> str:
+    """Normalizes Flex dates (YYYYMMDD or YYYYMMDD;HHMMSS) to YYYY-MM-DD."""
+    if not value:
+        return ""
+    value = value.split(";")[0]
+    if len(value) == 8 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+    return value
+
+
+_COLUMNS = "ticker, fecha, ex_date, pay_date, currency, gross, tax, fee, net, fx_rate, description"
+
+_INSERT_DIVIDEND = (
+    f"INSERT OR IGNORE INTO dividends (account_id, {_COLUMNS}) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _dividend_row(d: Dict) -> tuple:
+    return (
+        d.get("accountId") or "",
+        d.get("ticker") or "",
+        d.get("fecha") or "",
+        _iso_date(d.get("exDate", "")),
+        _iso_date(d.get("payDate", "")) or d.get("fecha") or "",
+        d.get("currency") or "",
+        abs(d.get("dividendo_bruto", 0)),
+        d.get("tax", 0),
+        abs(d.get("fee", 0)),
+        abs(d.get("netAmount", 0)),
+        d.get("fxRateToBase", 1),
+        d.get("description", ""),
+    )
+
+
+class DividendStore:
+    """
+    Local SQLite history of the dividends seen on previous runs.
+
+    Args:
+        db_path (str): Path of the database file; the directory is created if needed.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv("DIVIDEND_DB_PATH", DEFAULT_DB_PATH)
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self._migrate()
+        self.conn.executescript(_SCHEMA)
+
+    def _migrate(self):
+        """
+        Adds the account to the key of a history created before records
+        carried it, so the same payment in two accounts is kept twice.
+        Existing records get an empty account.
+        """
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(dividends)")]
+        if not columns or "account_id" in columns:
+            return
+        self.conn.executescript(
+            "BEGIN;"
+            "ALTER TABLE dividends RENAME TO dividends_old;"
+            "DROP INDEX IF EXISTS idx_dividends_ticker_pay_date;"
+            f"{_SCHEMA}"
+            f"INSERT INTO dividends ({_COLUMNS}) SELECT {_COLUMNS} FROM dividends_old;"
+            "DROP TABLE dividends_old;"
+            "COMMIT;"
+        )
+        logging.getLogger(__name__).info("Dividend history migrated to per-account records")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_dividends(self, dividends: Iterable[Dict]) -> Set[str]:
+        """
+        Stores dividend records, ignoring the ones already in the history.
+
+        Args:
+            dividends (Iterable[Dict]): Records as returned by `get_all_dividends`.
+
+        Returns:
+            Set[str]: Tickers that received at least one new record.
+        """
+        changed = set()
+        with self.conn:
+            for d in dividends:
+                cursor = self.conn.execute(_INSERT_DIVIDEND, _dividend_row(d))
+                if cursor.rowcount:
+                    changed.add(d.get("ticker") or "")
+        logging.getLogger(__name__).info(f"Stored new dividends for {len(changed)} tickers")
+        return changed
+
+    def bulk_add_dividends(self, dividends: List[Dict], commit: bool = True) -> int:
+        """
+        Stores a batch of records, ignoring duplicates. The batch is its own
+        transaction, unless `commit` is False: then it joins the open
+        transaction, which the caller commits or rolls back.
+
+        Returns:
+            int: Number of new records.
+        """
+        before = self.conn.total_changes
+        rows = [_dividend_row(d) for d in dividends]
+        if commit:
+            with self.conn:
+                self.conn.executemany(_INSERT_DIVIDEND, rows)
+        else:
+            self.conn.executemany(_INSERT_DIVIDEND, rows)
+        return self.conn.total_changes - before
+
+    def clear(self, commit: bool = True):
+        """Deletes the history and the calendar derived from it; see `bulk_add_dividends` for `commit`."""
+        self.conn.execute("DELETE FROM dividends")
+        self.conn.execute("DELETE FROM dividend_calendar")
+        if commit:
+            self.conn.commit()
+
+    def tickers(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT ticker FROM dividends ORDER BY ticker")]
+
+    def payments(self, ticker: str) -> List[sqlite3.Row]:
+        """
+        Returns one row per distinct payment of a ticker, oldest first.
+        Accruals, their reversals and cash transactions of the same payment
+        share the pay date, so they are collapsed into a single row.
+        """
+        return self.conn.execute(
+            "SELECT pay_date, MAX(ex_date) AS ex_date, MAX(gross) AS gross, "
+            "MAX(currency) AS currency, MAX(description) AS description "
+            "FROM dividends WHERE ticker = ? AND pay_date != '' "
+            "GROUP BY pay_date ORDER BY pay_date",
+            (ticker,),
+        ).fetchall()
@@ -4,7 +4,10 @@ import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
+from money import DividendAmounts, to_float
+from positions import position_yields
+from profiler import profile_stage
 
 def _format_date(date_str: str) -> str:
     """
@@ -56,13 +59,17 @@ def _get_dates_string(dividends: List[Dict], fallback_date: str) -> str:
         return f"{formatted_dates[0]} to {formatted_dates[-1]}"
 
 
-def send_dividend_email(dividends: List[Dict], date: str):
+class EmailConfigError(Exception):
+    """Raised when the SMTP settings in the environment are incomplete."""
+
+def send_dividend_email(dividends: List[Dict], date: str, upcoming: Optional[List[Dict]] = None):
     """
     Sends an email with the received dividends.
 
     Args:
         dividends (List[Dict]): List of dividends.
         date (str): Reference date in YYYY-MM-DD format, used as a fallback.
+        upcoming (Optional[List[Dict]]): Expected payments from the dividend calendar, shown in an extra section.
     """
     logger = logging.getLogger(__name__)
     
@@ -71,97 +78,251 @@ def send_dividend_email(dividends: List[Dict], date: str):
         return
     
     try:
-        # Email configuration from environment variables
-        smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        sender_email = os.getenv('SENDER_EMAIL')
-        recipient_email = os.getenv('RECIPIENT_EMAIL')
-
-        # Use specific credentials for the email sending API
-        smtp_username = os.getenv("SMTP_USERNAME")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-        
-        if not all([sender_email, smtp_username, smtp_password, recipient_email]):
-            logger.error("Email configuration is incomplete. Check SENDER_EMAIL, RECIPIENT_EMAIL, SMTP_USERNAME, and SMTP_PASSWORD environment variables.")
-            return
-
         # Generate the date string for the title
         dates_str = _get_dates_string(dividends, date)
+
+        # Calculate totals
+        with profile_stage("aggregate"):
+            summary = _aggregate_dividends(dividends)
+
+        send_report_email(dividends, dates_str, summary, upcoming)
         
-        # Create message
-        message = MIMEMultipart("alternative")
-        message["Subject"] = f"💰 Dividendos del {dates_str}"
-        message["From"] = sender_email
-        message["To"] = recipient_email
-        
-        # Create HTML content
-        html_content = _create_html_content(dividends, dates_str)
-        
-        # Attach HTML content
-        html_part = MIMEText(html_content, "html")
-        message.attach(html_part)
-        
-        # Send email
-        logger.info(f"Sending email to {recipient_email}")
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(message)
-        
-        logger.info("Email sent successfully")
-        
+    except EmailConfigError as e:
+        logger.error(str(e))
     except Exception as e:
         logger.error(f"Error sending email: {str(e)}")
 
-def _create_html_content(dividends: List[Dict], dates_display_str: str) -> str:
+def send_report_email(dividends: List[Dict], dates_str: str, summary: Dict,
+                      upcoming: Optional[List[Dict]] = None, timeout: Optional[float] = None):
+    """
+    Renders and sends the email for already aggregated dividends.
+    Unlike `send_dividend_email`, errors are raised to the caller.
+
+    Args:
+        dividends (List[Dict]): List of dividends.
+        dates_str (str): String with formatted dates to display.
+        summary (Dict): Totals from `_aggregate_dividends`.
+        upcoming (Optional[List[Dict]]): Expected payments from the dividend calendar.
+        timeout (Optional[float]): SMTP socket timeout in seconds.
+    """
+    logger = logging.getLogger(__name__)
+
+    # Email configuration from environment variables
+    smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+    smtp_port = int(os.getenv('SMTP_PORT', '587'))
+    smtp_use_tls = os.getenv('SMTP_USE_TLS', 'true').lower() != 'false'
+    sender_email = os.getenv('SENDER_EMAIL')
+    recipient_email = os.getenv('RECIPIENT_EMAIL')
+
+    # Use specific credentials for the email sending API
+    smtp_username = os.getenv("SMTP_USERNAME")
+    smtp_password = os.getenv("SMTP_PASSWORD")
+    
+    if not all([sender_email, smtp_username, smtp_password, recipient_email]):
+        raise EmailConfigError("Email configuration is incomplete. Check SENDER_EMAIL, RECIPIENT_EMAIL, SMTP_USERNAME, and SMTP_PASSWORD environment variables.")
+
+    # Create message
+    message = MIMEMultipart("alternative")
+    message["Subject"] = f"💰 Dividendos del {dates_str}"
+    message["From"] = sender_email
+    message["To"] = recipient_email
+    
+    # Create HTML content
+    with profile_stage("render"):
+        html_content = _create_html_content(dividends, dates_str, summary, upcoming)
+    
+    # Attach HTML content
+    html_part = MIMEText(html_content, "html")
+    message.attach(html_part)
+    
+    # Send email
+    logger.info(f"Sending email to {recipient_email}")
+    
+    smtp_kwargs = {"timeout": timeout} if timeout else {}
+    with profile_stage("send"), smtplib.SMTP(smtp_server, smtp_port, **smtp_kwargs) as server:
+        if smtp_use_tls:
+            server.starttls()
+        server.login(smtp_username, smtp_password)
+        server.send_message(message)
+    
+    logger.info("Email sent successfully")
+
+def _aggregate_dividends(dividends: List[Dict], positions=None,
+                         payments_per_year: Optional[Dict[str, int]] = None) -> Dict:
+    """
+    Calculates the totals in EUR and collects the exchange rates used.
+    Every amount is converted to EUR once, in integer micro-units rounded to
+    cents, so the totals are the exact sum of the amounts shown per row.
+
+    Args:
+        dividends (List[Dict]): List of dividends.
+        positions (Optional[PositionIndex]): Open positions of the same statement.
+        payments_per_year (Optional[Dict[str, int]]): Payment frequency per ticker, for the annualized yield.
+
+    Returns:
+        Dict: Totals (total_gross_eur, total_tax_eur, total_net_eur),
+        exchange_rates by currency, the gross, tax and net EUR amounts
+        per dividend (rows_eur), the yield on cost per position (positions)
+        and the date of the cached statement used when IBKR was unavailable
+        (stale, else None).
+    """
+    amounts = DividendAmounts(dividends)
+    totals = amounts.totals()
+    stale_dates = sorted({d.get('statementDate', '') for d in dividends if d.get('stale')})
+
+    return {
+        "total_gross_eur": to_float(totals["gross"]),
+        "total_tax_eur": to_float(totals["tax"]),
+        "total_net_eur": to_float(totals["net"]),
+        "exchange_rates": amounts.exchange_rates(),
+        "rows_eur": amounts.base_columns(),
+        "positions": position_yields(dividends, amounts, positions, payments_per_year) if positions else [],
+        "stale": stale_dates[-1] if stale_dates else None,
+    }
+
+def _create_upcoming_section(upcoming: List[Dict]) -> str:
+    """
+    Creates the optional "Upcoming Dividends" section of the email.
+
+    Args:
+        upcoming (List[Dict]): Entries from `forecast.upcoming_dividends`.
+
+    Returns:
+        str: HTML section, or an empty string if there is nothing to show.
+    """
+    if not upcoming:
+        return ""
+
+    rows = ""
+    for entry in upcoming:
+        currency_symbol = "$" if entry.get("currency") == "USD" else entry.get("currency", "")
+        rows += f"""
+        <tr>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; font-weight: 600; color: #2c3e50;">{entry['ticker']}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; color: #7f8c8d;">{entry.get('next_ex_date') or '-'}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; color: #2c3e50;">{entry['next_pay_date']}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; color: #7f8c8d;">{entry['frequency']}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; color: #27ae60;">~{currency_symbol}{entry['last_amount']:.2f}</td>
+        </tr>
+        """
+
+    return f"""
+            <!-- Upcoming Dividends -->
+            <div style="padding: 0 30px 30px 30px;">
+                <h2 style="color: #2c3e50; margin: 0 0 20px 0; font-size: 20px; font-weight: 600;">Upcoming Dividends</h2>
+                <table style="width: 100%; border-collapse: collapse; background: white;">
+                    <thead>
+                        <tr style="background: #f8f9fc;">
+                            <th style="padding: 12px; text-align: left; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Ticker</th>
+                            <th style="padding: 12px; text-align: left; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Expected Ex-Date</th>
+                            <th style="padding: 12px; text-align: left; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Expected Pay Date</th>
+                            <th style="padding: 12px; text-align: left; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Frequency</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Last Amount</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {rows}
+                    </tbody>
+                </table>
+            </div>
+    """
+
+def _format_yield(value: Optional[float]) -> str:
+    return f"{value * 100:.2f}%" if value is not None else "-"
+
+def _create_positions_section(positions: List[Dict]) -> str:
+    """
+    Creates the optional "Yield on Cost" section of the email.
+
+    Args:
+        positions (List[Dict]): Entries from `positions.position_yields`.
+
+    Returns:
+        str: HTML section, or an empty string if there is nothing to show.
+    """
+    if not positions:
+        return ""
+
+    rows = []
+    for entry in positions:
+        rows.append(f"""
+        <tr>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; font-weight: 600; color: #2c3e50;">{entry['ticker']}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; color: #7f8c8d;">{entry['quantity']:g}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; color: #2c3e50;">€{entry['cost_basis_eur']:.2f}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; color: #27ae60;">€{entry['dividends_eur']:.2f}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; color: #2980b9;">{_format_yield(entry['yield_on_cost'])}</td>
+            <td style="padding: 10px 12px; border-bottom: 1px solid #e0e0e0; text-align: right; font-weight: 600; color: #2980b9;">{_format_yield(entry['annualized_yield'])}</td>
+        </tr>
+        """)
+
+    return f"""
+            <!-- Yield on Cost -->
+            <div style="padding: 0 30px 30px 30px;">
+                <h2 style="color: #2c3e50; margin: 0 0 20px 0; font-size: 20px; font-weight: 600;">Yield on Cost</h2>
+                <table style="width: 100%; border-collapse: collapse; background: white;">
+                    <thead>
+                        <tr style="background: #f8f9fc;">
+                            <th style="padding: 12px; text-align: left; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Ticker</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Shares</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Cost Basis</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Dividends</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Yield on Cost</th>
+                            <th style="padding: 12px; text-align: right; color: #2c3e50; border-bottom: 2px solid #e0e0e0;">Annualized</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {"".join(rows)}
+                    </tbody>
+                </table>
+            </div>
+    """
+
+def _create_html_content(dividends: List[Dict], dates_display_str: str, summary: Optional[Dict] = None,
+                         upcoming: Optional[List[Dict]] = None) -> str:
     """
     Creates the HTML content for the email.
 
     Args:
         dividends (List[Dict]): List of dividends.
         dates_display_str (str): String with formatted dates to display.
+        summary (Optional[Dict]): Totals from `_aggregate_dividends`; calculated if not given.
+        upcoming (Optional[List[Dict]]): Expected payments to show in the "Upcoming Dividends" section.
 
     Returns:
         str: Formatted HTML content.
     """
     
-    # --- Calculation of totals and exchange rates ---
-    total_gross_eur = 0
-    total_tax_eur = 0
-    total_net_eur = 0
-    exchange_rates = {}  # To store unique exchange rates
-
-    # Calculate totals in EUR and collect exchange rates
-    for d in dividends:
-        fx_rate = d.get('fxRateToBase', 1)
-        total_gross_eur += abs(d['dividendo_bruto']) * fx_rate
-        total_tax_eur += abs(d['tax']) * fx_rate
-        total_net_eur += abs(d['netAmount']) * fx_rate
-        
-        # Save the exchange rate if we don't have it already
-        currency = d.get('currency')
-        if currency and currency not in exchange_rates:
-            exchange_rates[currency] = fx_rate
+    # --- Totals and exchange rates ---
+    if summary is None or "rows_eur" not in summary:
+        summary = _aggregate_dividends(dividends)
+    total_gross_eur = summary["total_gross_eur"]
+    total_tax_eur = summary["total_tax_eur"]
+    total_net_eur = summary["total_net_eur"]
+    exchange_rates = summary["exchange_rates"]
             
+    # Banner when IBKR was unavailable and a cached statement was used
+    stale_banner = ""
+    if summary.get("stale"):
+        stale_banner = f"""
+            <div style="background: #fdecea; color: #c0392b; padding: 15px 30px; font-size: 14px; border-bottom: 1px solid #f5c6cb;">
+                ⚠️ IBKR was unavailable. This report uses a cached statement from {summary["stale"]} and may be out of date.
+            </div>
+            """
+
     # Create the footer string with all currencies
     rate_strings = [f"1 {cur} = €{rate:.4f}" for cur, rate in exchange_rates.items()]
     footer_rates_text = " • ".join(rate_strings) if rate_strings else "No se encontraron tipos de cambio."
     
-    # --- End of calculation ---
-
-    # Create table rows
-    table_rows = ""
-    for dividend in dividends:
-        fx_rate = dividend.get('fxRateToBase', 1)
-        gross_eur = abs(dividend['dividendo_bruto']) * fx_rate
-        tax_eur = abs(dividend['tax']) * fx_rate
-        net_eur = abs(dividend['netAmount']) * fx_rate
-        
+    # --- End of totals ---
+
+    # Create table rows, with the EUR amounts converted in _aggregate_dividends
+    row_strings = []
+    for dividend, gross_eur, tax_eur, net_eur in zip(dividends, *summary["rows_eur"]):
         # Determine the currency symbol
         currency_symbol = "$" if dividend.get("currency") == "USD" else dividend.get("currency", "")
         
-        table_rows += f"""
+        row_strings.append(f"""
         <tr>
             <td style="padding: 12px; border-bottom: 1px solid #e0e0e0; font-weight: 600; color: #2c3e50;">
                 {dividend['ticker']}
@@ -182,7 +343,8 @@ def _create_html_content(dividends: List[Dict], dates_display_str: str) -> str:
                 <span style="font-size: 12px; color: #7f8c8d;">€{net_eur:.2f}</span>
             </td>
         </tr>
-        """
+        """)
+    table_rows = "".join(row_strings)
     
     html_content = f"""
     <!DOCTYPE html>
@@ -200,7 +362,7 @@ def _create_html_content(dividends: List[Dict], dates_display_str: str) -> str:
                 <h1 style="margin: 0; font-size: 28px; font-weight: 300;">💰 Dividend Summary</h1>
                 <p style="margin: 10px 0 0 0; font-size: 16px; opacity: 0.9;">{dates_display_str}</p>
             </div>
-            
+            {stale_banner}
             <!-- Summary Cards (consolidated total in EUR) -->
             <div style="padding: 30px; background-color: #f8f9fc;">
                 <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px;">
@@ -244,7 +406,8 @@ def _create_html_content(dividends: List[Dict], dates_display_str: str) -> str:
                     </table>
                 </div>
             </div>
-            
+            {_create_positions_section(summary.get("positions"))}
+            {_create_upcoming_section(upcoming)}
             <!-- Footer -->
             <div style="background: #f8f9fc; padding: 20px; text-align: center; border-top: 1px solid #e0e0e0;">
                 <p style="margin: 0; color: #7f8c8d; font-size: 14px;">
@@ -0,0 +1,137 @@
+import csv
+import json
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+# Stable export schema: field name and type, in column order. Field names are
+# the keys of the records produced by get_all_dividends.
+EXPORT_SCHEMA: List[Tuple[str, type]] = [
+    ("ticker", str),
+    ("fecha", str),
+    ("exDate", str),
+    ("payDate", str),
+    ("currency", str),
+    ("dividendo_bruto", float),
+    ("tax", float),
+    ("fee", float),
+    ("netAmount", float),
+    ("fxRateToBase", float),
+    ("description", str),
+]
+EXPORT_FIELDS = [name for name, _ in EXPORT_SCHEMA]
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+
+def _normalize(record: Dict) -> Dict:
+    """Projects a record onto the export schema, with one type per column."""
+    normalized = {}
+    for name, field_type in EXPORT_SCHEMA:
+        value = record.get(name)
+        if field_type is float:
+            normalized[name] = float(value) if value not in (None, "") else 0.0
+        else:
+            normalized[name] = "" if value is None else str(value)
+    return normalized
+
+
+class JsonLinesExporter:
+    """Writes one JSON object per line."""
+
+    binary = False
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write_batch(self, records: List[Dict]):
+        self.stream.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+    def close(self):
+        self.stream.flush()
+
+
+class CsvExporter:
+    """Writes a CSV file with a header row."""
+
+    binary = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        self.writer.writeheader()
+
+    def write_batch(self, records: List[Dict]):
+        self.writer.writerows(records)
+
+    def close(self):
+        self.stream.flush()
+
+
+class ParquetExporter:
+    """Writes a Parquet file with one row group per batch (requires pyarrow)."""
+
+    binary = True
+
+    def __init__(self, stream):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Parquet export requires pyarrow. Install it with: pip install -r requirements-parquet.txt")
+        self.pa = pa
+        self.schema = pa.schema([
+            (name, pa.float64() if field_type is float else pa.string())
+            for name, field_type in EXPORT_SCHEMA
+        ])
+        self.writer = pq.ParquetWriter(stream, self.schema)
+
+    def write_batch(self, records: List[Dict]):
+        columns = {name: [r[name] for r in records] for name in EXPORT_FIELDS}
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORTERS = {
+    "jsonl": JsonLinesExporter,
+    "csv": CsvExporter,
+    "parquet": ParquetExporter,
+}
+
+
+def export_dividends(records: Iterable[Dict], export_format: str, stream, batch_size: int = 10000) -> int:
+    """
+    Streams dividend records to `stream` in the given format. Only one batch
+    of records is held in memory at a time; for Parquet each batch becomes a
+    row group.
+
+    Args:
+        records (Iterable[Dict]): Records as produced by `iter_dividends` / `get_all_dividends`.
+        export_format (str): One of EXPORT_FORMATS.
+        stream: Text stream for jsonl/csv, binary stream for parquet.
+        batch_size (int): Records per batch (Parquet row group size).
+
+    Returns:
+        int: Number of records exported.
+    """
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {export_format}. Use one of {', '.join(EXPORT_FORMATS)}")
+
+    exporter = EXPORTERS[export_format](stream)
+    exported = 0
+    batch = []
+    try:
+        for record in records:
+            batch.append(_normalize(record))
+            if len(batch) >= batch_size:
+                exporter.write_batch(batch)
+                exported += len(batch)
+                batch = []
+        if batch:
+            exporter.write_batch(batch)
+            exported += len(batch)
+    finally:
+        exporter.close()
+
+    logging.getLogger(__name__).info(f"Exported {exported} dividends as {export_format}")
+    return exported
@@ -0,0 +1,112 @@
+import calendar
+import logging
+from datetime import date, datetime, timedelta
+from statistics import median
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dividend_store import DividendStore
+
+# (label, payments per year, months between payments, max median gap in days)
+FREQUENCIES = [
+    ("monthly", 12, 1, 45),
+    ("quarterly", 4, 3, 135),
+    ("semiannual", 2, 6, 270),
+    ("annual", 1, 12, None),
+]
+
+
+def detect_frequency(pay_dates: List[str]) -> Tuple[str, int, int]:
+    """
+    Detects the payment frequency from the median gap between pay dates.
+
+    Args:
+        pay_dates (List[str]): Sorted pay dates in YYYY-MM-DD format.
+
+    Returns:
+        Tuple[str, int, int]: Label, payments per year and months between
+        payments. ("unknown", 0, 0) if there are fewer than two payments.
+    """
+    if len(pay_dates) < 2:
+        return "unknown", 0, 0
+    parsed = [datetime.strptime(d, "%Y-%m-%d").date() for d in pay_dates]
+    gap = median((b - a).days for a, b in zip(parsed, parsed[1:]))
+    for label, per_year, months, max_gap in FREQUENCIES:
+        if max_gap is None or gap <= max_gap:
+            return label, per_year, months
+    return "unknown", 0, 0
+
+
+def _add_months(value: str, months: int) -> Optional[str]:
+    if not value or not months:
+        return None
+    d = datetime.strptime(value, "%Y-%m-%d").date()
+    month_index = d.month - 1 + months
+    year = d.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day).isoformat()
+
+
+def update_calendar(store: DividendStore, tickers: Iterable[str]):
+    """
+    Recomputes the calendar entries of the given tickers only, so each run
+    costs proportionally to the tickers that received new dividends.
+
+    Args:
+        store (DividendStore): History store.
+        tickers (Iterable[str]): Tickers whose history changed.
+    """
+    updated = 0
+    with store.conn:
+        for ticker in tickers:
+            payments = store.payments(ticker)
+            if not ticker or not payments:
+                continue
+            label, per_year, months = detect_frequency([p["pay_date"] for p in payments])
+            last = payments[-1]
+            store.conn.execute(
+                "INSERT OR REPLACE INTO dividend_calendar "
+                "(ticker, frequency, payments_per_year, payments_seen, last_ex_date, last_pay_date, "
+                "last_amount, currency, description, next_ex_date, next_pay_date) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ticker, label, per_year, len(payments), last["ex_date"], last["pay_date"],
+                    last["gross"], last["currency"], last["description"],
+                    _add_months(last["ex_date"], months), _add_months(last["pay_date"], months),
+                ),
+            )
+            updated += 1
+    logging.getLogger(__name__).info(f"Dividend calendar updated for {updated} tickers")
+
+
+def upcoming_dividends(store: DividendStore, days: int = 30, today: Optional[str] = None) -> List[Dict]:
+    """
+    Returns the payments expected in the next `days` days, using the index
+    on the next expected pay date.
+
+    Args:
+        store (DividendStore): History store.
+        days (int): Size of the window.
+        today (Optional[str]): Start of the window in YYYY-MM-DD format; defaults to today.
+
+    Returns:
+        List[Dict]: Calendar entries ordered by next expected pay date.
+    """
+    start = datetime.strptime(today, "%Y-%m-%d").date() if today else date.today()
+    end = start + timedelta(days=days)
+    rows = store.conn.execute(
+        "SELECT * FROM dividend_calendar WHERE next_pay_date BETWEEN ? AND ? "
+        "ORDER BY next_pay_date, ticker",
+        (start.isoformat(), end.isoformat()),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def payments_per_year(store: DividendStore) -> Dict[str, int]:
+    """Returns the detected number of payments per year of every ticker with a known frequency."""
+    return {
+        row["ticker"]: row["payments_per_year"]
+        for row in store.conn.execute(
+            "SELECT ticker, payments_per_year FROM dividend_calendar WHERE payments_per_year > 0"
+        )
+    }
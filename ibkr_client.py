@@ -1,30 +1,138 @@
+import io
 import logging
 import os
 import time
 import requests
+import sqlite3
 import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from profiler import profile_stage
+from rate_limiter import FlexRateLimiter
+from resilience import CircuitBreaker, LatencyTracker
+from statement_archive import StatementArchive
+from watermark import FlexWatermarks, completed_through
+
+DEFAULT_BASE_URL = "https://gdcdyn.interactivebrokers.com/Universal/servlet"
+# Flex Web Service error code for "Too many requests have been made from this token"
+THROTTLED_ERROR_CODE = "1018"
+GET_STATEMENT = "FlexStatementService.GetStatement"
 
 class IBKRFlexQuery:
-    def __init__(self, token):
+    def __init__(self, token, base_url=DEFAULT_BASE_URL, poll_interval=2, rate_limiter=None,
+                 max_throttle_retries=5, circuit_breaker=None, latency_tracker=None,
+                 hedge_percentile=95, request_timeout=30):
         self.token = token
-        self.base_url = "https://gdcdyn.interactivebrokers.com/Universal/servlet"
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+        self.rate_limiter = rate_limiter or FlexRateLimiter(token)
+        self.max_throttle_retries = max_throttle_retries
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(token)
+        self.latency_tracker = latency_tracker or LatencyTracker()
+        self.hedge_percentile = hedge_percentile
+        self.request_timeout = request_timeout
+
+    def _get(self, url, params):
+        """
+        Sends a request within the shared per-token budget. Throttling
+        responses back off every process using the token and are retried
+        without counting as poll attempts.
+        """
+        return self._get_timed(url, params)[0]
+
+    def _get_timed(self, url, params, reserved=False):
+        """
+        Like `_get`, also returning the seconds of the HTTP round trip that
+        answered, without the time spent waiting for the request budget.
+        `reserved` means the caller already took the budget for the first attempt.
+        """
+        for attempt in range(self.max_throttle_retries + 1):
+            if attempt or not reserved:
+                self.rate_limiter.acquire()
+            started = time.perf_counter()
+            response = requests.get(url, params=params, timeout=self.request_timeout)
+            elapsed = time.perf_counter() - started
+            if not _is_throttled(response):
+                response.raise_for_status()
+                return response, elapsed
+            if attempt < self.max_throttle_retries:
+                self.rate_limiter.penalize(attempt)
+        raise Exception("Error in IBKR: too many requests, throttling persisted after backing off")
+
+    def _get_hedged(self, url, params):
+        """
+        GetStatement poll that sends a duplicate request when the first one
+        takes longer than the recent `hedge_percentile` latency, and uses
+        whichever answers first. Latencies are HTTP round trips only, and the
+        duplicate is only sent if the request budget has a slot right away,
+        so hedging never adds to throttling.
+        """
+        logger = logging.getLogger(__name__)
+        threshold = self.latency_tracker.percentile(GET_STATEMENT, self.hedge_percentile)
+        if threshold is None:
+            response, elapsed = self._get_timed(url, params)
+        else:
+            # Waiting for the budget happens before the hedge timer starts
+            self.rate_limiter.acquire()
+            executor = ThreadPoolExecutor(max_workers=2)
+            try:
+                primary = executor.submit(self._get_timed, url, params, True)
+                done, _ = wait([primary], timeout=threshold)
+                if done:
+                    response, elapsed = primary.result()
+                elif not self.rate_limiter.try_acquire():
+                    logger.info(f"GetStatement slower than p{self.hedge_percentile}, no request budget left to hedge it")
+                    response, elapsed = primary.result()
+                else:
+                    logger.info(
+                        f"GetStatement slower than p{self.hedge_percentile} ({threshold:.2f}s), sending hedged request"
+                    )
+                    hedge = executor.submit(self._get_timed, url, params, True)
+                    done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+                    # Both may finish together; a failure only counts if no request succeeded
+                    succeeded = [future for future in done if future.exception() is None]
+                    if succeeded:
+                        first = succeeded[0]
+                    elif pending:
+                        first = wait(pending).done.pop()
+                    else:
+                        first = done.pop()
+                    response, elapsed = first.result()
+            finally:
+                # The slower request is not awaited
+                executor.shutdown(wait=False)
+        self.latency_tracker.record(GET_STATEMENT, elapsed)
+        return response
     
-    def execute_query(self, query_id, version="3"):
-        reference_code = self._request_query_execution(query_id, version)
-        if not reference_code:
-            raise Exception("Error requesting query execution")
-        return self._get_query_results(reference_code, version)
+    def execute_query(self, query_id, version="3", from_date=None, to_date=None):
+        """
+        Runs a Flex Query and returns the statement XML. `from_date` and
+        `to_date` (datetime.date) override the period configured in the query.
+        """
+        # Fails within milliseconds while IBKR is known to be down
+        self.circuit_breaker.check()
+        try:
+            reference_code = self._request_query_execution(query_id, version, from_date, to_date)
+            if not reference_code:
+                raise Exception("Error requesting query execution")
+            result = self._get_query_results(reference_code, version)
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+        return result
     
-    def _request_query_execution(self, query_id, version):
+    def _request_query_execution(self, query_id, version, from_date=None, to_date=None):
         url = f"{self.base_url}/FlexStatementService.SendRequest"
         params = {
             't': self.token,
             'q': query_id,
             'v': version
         }
+        if from_date and to_date:
+            params['fd'] = from_date.strftime("%Y%m%d")
+            params['td'] = to_date.strftime("%Y%m%d")
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            response = self._get(url, params)
             root = ET.fromstring(response.text)
             if root.find('.//ErrorMessage') is not None:
                 raise Exception(f"Error in IBKR: {root.find('.//ErrorMessage').text}")
@@ -36,7 +144,7 @@ class IBKRFlexQuery:
             raise Exception(f"Request error: {e}")
     
     def _get_query_results(self, reference_code, version, max_attempts=30):
-        url = f"{self.base_url}/FlexStatementService.GetStatement"
+        url = f"{self.base_url}/{GET_STATEMENT}"
         params = {
             't': self.token,
             'q': reference_code,
@@ -44,10 +152,9 @@ class IBKRFlexQuery:
         }
         for attempt in range(max_attempts):
             try:
-                response = requests.get(url, params=params)
-                response.raise_for_status()
+                response = self._get_hedged(url, params)
                 if "Statement generation in progress" in response.text:
-                    time.sleep(2)
+                    time.sleep(self.poll_interval)
                     continue
                 root = ET.fromstring(response.text)
                 if root.find('.//ErrorMessage') is not None:
@@ -57,69 +164,204 @@ class IBKRFlexQuery:
                 raise Exception(f"Request error: {e}")
         raise Exception("Timeout: Statement was not generated in the expected time")
 
-def get_all_dividends() -> list:
-    """Gets all dividends from the IBKR Flex Query, without filtering by date"""
+def _is_throttled(response) -> bool:
+    if response.status_code == 429:
+        return True
+    return f"<ErrorCode>{THROTTLED_ERROR_CODE}</ErrorCode>" in response.text
+
+def _format_flex_date(value: str) -> str:
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}" if value else ""
+
+def _accrual_to_dividend(accrual) -> dict:
+    return {
+        "ticker": accrual.get("symbol"),
+        "fecha": _format_flex_date(accrual.get("date")),
+        "dividendo_bruto": abs(float(accrual.get("grossAmount", 0))),
+        "tax": float(accrual.get("tax", 0)),
+        "currency": accrual.get("currency"),
+        "fxRateToBase": float(accrual.get("fxRateToBase", 1)),
+        "description": accrual.get("description", ""),
+        "exDate": accrual.get("exDate", ""),
+        "payDate": accrual.get("payDate", ""),
+        "fee": abs(float(accrual.get("fee", 0))),
+        "netAmount": abs(float(accrual.get("netAmount", 0))),
+        "accountId": accrual.get("accountId", ""),
+        "conid": accrual.get("conid", "")
+    }
+
+def _cash_transaction_to_dividend(cash_txn):
+    activity_description = cash_txn.get("activityDescription", "")
+    if "dividend" not in activity_description.lower():
+        return None
+    formatted_date = _format_flex_date(cash_txn.get("dateTime", ""))
+    return {
+        "ticker": cash_txn.get("symbol", ""),
+        "fecha": formatted_date,
+        "dividendo_bruto": abs(float(cash_txn.get("amount", 0))),
+        "tax": 0,
+        "currency": cash_txn.get("currency", ""),
+        "fxRateToBase": abs(float(cash_txn.get("fxRateToBase", 1))),
+        "description": activity_description,
+        "exDate": "",
+        "payDate": formatted_date,
+        "fee": 0,
+        "netAmount": abs(float(cash_txn.get("amount", 0))),
+        "accountId": cash_txn.get("accountId", ""),
+        "conid": cash_txn.get("conid", "")
+    }
+
+def iter_dividends(source, statements=None, positions=None):
+    """
+    Streams the dividend records of a Flex statement as they are parsed.
+    Processed elements are removed from the tree, so memory stays bounded
+    regardless of the statement size.
+
+    Args:
+        source: Statement XML as str/bytes, or a binary file object.
+        statements (list): If given, the attributes of every FlexStatement
+            (accountId, fromDate, toDate, whenGenerated...) are appended to it.
+        positions (PositionIndex): If given, the OpenPosition rows of the
+            statement are added to it, to be joined with the dividends.
+
+    Yields:
+        dict: Dividend records from ChangeInDividendAccrual and CashTransaction (if they exist).
+    """
+    if isinstance(source, str):
+        source = io.BytesIO(source.encode("utf-8"))
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    parents = []
+    account_id = ""
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            if elem.tag == "FlexStatement":
+                account_id = elem.get("accountId", "")
+                if statements is not None:
+                    statements.append(dict(elem.attrib))
+            continue
+        parents.pop()
+
+        dividend = None
+        if elem.tag == "ChangeInDividendAccrual":
+            dividend = _accrual_to_dividend(elem)
+        elif elem.tag == "CashTransaction":
+            dividend = _cash_transaction_to_dividend(elem)
+        elif elem.tag == "OpenPosition" and positions is not None:
+            positions.add(elem.attrib, account_id)
+
+        # Children are removed as they end, so every element is a leaf here
+        if parents:
+            parents[-1].remove(elem)
+        if dividend is not None:
+            dividend["accountId"] = dividend["accountId"] or account_id
+            yield dividend
+
+def parse_dividends(xml_data: str) -> list:
+    """Extracts the dividend records from a Flex statement XML"""
+    return list(iter_dividends(xml_data))
+
+def fetch_dividends_statement(token: str, query_id: str, from_date=None, to_date=None) -> str:
+    """Runs the Flex Query, optionally for a date window, and returns the raw statement XML"""
+    client = IBKRFlexQuery(token)
+    with profile_stage("fetch"):
+        return client.execute_query(query_id, from_date=from_date, to_date=to_date)
+
+def get_all_dividends(positions=None, pending_watermarks=None) -> list:
+    """
+    Gets the dividends from the IBKR Flex Query, without filtering by date.
+    If `positions` (PositionIndex) is given, the open positions of the same
+    statement are added to it.
+    Once a statement has been processed, only the days after its period are
+    requested (see IBKR_DELTA_FETCH). If `pending_watermarks` (list) is given,
+    the new watermark is appended to it instead of being saved, so the caller
+    can save it with `commit_watermarks` once the dividends were delivered.
+    If IBKR fails, IBKR_FAILURE_POLICY decides: "cache" (default) uses the most
+    recent archived statement with every record marked as stale, "fail" raises.
+    Without credentials it raises, unless IBKR_USE_EXAMPLE_DATA is enabled.
+    """
     logger = logging.getLogger(__name__)
     logger.info("Querying ALL dividends from IBKR API")
     
-    try:
-        TOKEN = os.getenv('IBKR_FLEX_TOKEN')
-        QUERY_ID = os.getenv('IBKR_DIVIDENDS_QUERY_ID')
-        
-        if not TOKEN or not QUERY_ID:
-            logger.warning("Token or Query ID not configured, using example data")
-            return _get_example_dividends()
-        
-        client = IBKRFlexQuery(TOKEN)
-        xml_data = client.execute_query(QUERY_ID)
-        root = ET.fromstring(xml_data)
-        dividends = []
-
-        for accrual in root.findall(".//ChangeInDividendAccrual"):
-            accrual_date = accrual.get("date")
-            formatted_date = f"{accrual_date[:4]}-{accrual_date[4:6]}-{accrual_date[6:8]}" if accrual_date else ""
-            dividend = {
-                "ticker": accrual.get("symbol"),
-                "fecha": formatted_date,
-                "dividendo_bruto": abs(float(accrual.get("grossAmount", 0))),
-                "tax": float(accrual.get("tax", 0)),
-                "currency": accrual.get("currency"),
-                "fxRateToBase": float(accrual.get("fxRateToBase", 1)),
-                "description": accrual.get("description", ""),
-                "exDate": accrual.get("exDate", ""),
-                "payDate": accrual.get("payDate", ""),
-                "fee": abs(float(accrual.get("fee", 0))),
-                "netAmount": abs(float(accrual.get("netAmount", 0)))
-            }
-            dividends.append(dividend)
-
-        # Also include dividends from CashTransaction (if they exist)
-        for cash_txn in root.findall(".//CashTransaction"):
-            activity_description = cash_txn.get("activityDescription", "")
-            if "dividend" in activity_description.lower():
-                txn_date = cash_txn.get("dateTime", "")
-                formatted_date = f"{txn_date[:4]}-{txn_date[4:6]}-{txn_date[6:8]}" if txn_date else ""
-                dividend = {
-                    "ticker": cash_txn.get("symbol", ""),
-                    "fecha": formatted_date,
-                    "dividendo_bruto": abs(float(cash_txn.get("amount", 0))),
-                    "tax": 0,
-                    "currency": cash_txn.get("currency", ""),
-                    "fxRateToBase": abs(float(cash_txn.get("fxRateToBase", 1))),
-                    "description": activity_description,
-                    "exDate": "",
-                    "payDate": formatted_date,
-                    "fee": 0,
-                    "netAmount": abs(float(cash_txn.get("amount", 0)))
-                }
-                dividends.append(dividend)
-
-        logger.info(f"Found {len(dividends)} dividends in total")
-        return dividends
+    TOKEN = os.getenv('IBKR_FLEX_TOKEN')
+    QUERY_ID = os.getenv('IBKR_DIVIDENDS_QUERY_ID')
+    
+    if not TOKEN or not QUERY_ID:
+        # A missing or renamed secret must not send the example dividends as real ones
+        if os.getenv('IBKR_USE_EXAMPLE_DATA', 'false').lower() not in ('1', 'true', 'yes'):
+            raise Exception("Token or Query ID not configured (set IBKR_USE_EXAMPLE_DATA=true to use example data)")
+        logger.warning("Token or Query ID not configured, using example data")
+        return _get_example_dividends()
 
+    delta_fetch = os.getenv('IBKR_DELTA_FETCH', 'true').lower() not in ('0', 'false', 'no')
+    window = None
+    if delta_fetch:
+        try:
+            with FlexWatermarks() as watermarks:
+                window = watermarks.delta_window(QUERY_ID)
+        except sqlite3.Error as e:
+            logger.error(f"Error reading watermark, requesting the configured period: {str(e)}")
+        if window is not None:
+            if window[0] > window[1]:
+                logger.info("Statements already processed up to yesterday, nothing to request")
+                return []
+            logger.info(f"Requesting dividends from {window[0].isoformat()} to {window[1].isoformat()}")
+
+    statements = []
+    try:
+        xml_data = fetch_dividends_statement(TOKEN, QUERY_ID, *(window or (None, None)))
+        with profile_stage("parse"):
+            dividends = list(iter_dividends(xml_data, statements, positions))
     except Exception as e:
         logger.error(f"Error getting dividends from IBKR: {str(e)}")
-        return _get_example_dividends()
+        return _get_cached_dividends(QUERY_ID, e, positions)
+
+    try:
+        StatementArchive().save(QUERY_ID, xml_data)
+    except OSError as e:
+        logger.error(f"Error archiving statement: {str(e)}")
+
+    processed_through = completed_through(statements)
+    if delta_fetch and processed_through is not None:
+        pending = (QUERY_ID, processed_through, max(s.get("whenGenerated", "") for s in statements))
+        if pending_watermarks is None:
+            commit_watermarks([pending])
+        else:
+            pending_watermarks.append(pending)
+
+    logger.info(f"Found {len(dividends)} dividends in total")
+    return dividends
+
+def commit_watermarks(pending: list):
+    """Saves the (query_id, date, whenGenerated) watermarks returned by `get_all_dividends`"""
+    try:
+        with FlexWatermarks() as watermarks:
+            for query_id, processed_through, when_generated in pending:
+                watermarks.advance(query_id, processed_through, when_generated)
+    except sqlite3.Error as e:
+        logging.getLogger(__name__).error(f"Error saving watermark: {str(e)}")
+
+def _get_cached_dividends(query_id: str, error: Exception, positions=None) -> list:
+    """Applies IBKR_FAILURE_POLICY after a failed query; raises if there is no usable fallback"""
+    logger = logging.getLogger(__name__)
+    policy = os.getenv('IBKR_FAILURE_POLICY', 'cache').lower()
+    if policy != 'cache':
+        raise Exception(f"IBKR unavailable and IBKR_FAILURE_POLICY is '{policy}': {error}")
+
+    latest = StatementArchive().latest(query_id)
+    if latest is None:
+        raise Exception(f"IBKR unavailable and there is no cached statement to fall back to: {error}")
+
+    path, saved_at = latest
+    statement_date = saved_at.strftime("%Y-%m-%d %H:%M")
+    logger.warning(f"Using cached statement from {statement_date}, data may be stale")
+    with open(path, "rb") as f:
+        dividends = list(iter_dividends(f, positions=positions))
+    for dividend in dividends:
+        dividend["stale"] = True
+        dividend["statementDate"] = statement_date
+    return dividends
 
 def _get_example_dividends() -> list:
     logger = logging.getLogger(__name__)
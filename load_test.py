@@ -0,0 +1,441 @@
+import argparse
+import logging
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from ibkr_client import IBKRFlexQuery, parse_dividends
+from email_sender import send_dividend_email
+from rate_limiter import FlexRateLimiter
+from resilience import CircuitBreaker, LatencyTracker
+
+# Flex Web Service error codes reproduced by the fake server
+THROTTLED_CODE = "1018"
+IN_PROGRESS_CODE = "1019"
+ERROR_MESSAGES = {
+    "1001": "Statement could not be generated at this time. Please try again shortly.",
+    "1009": "The server is under heavy load. Statement could not be generated at this time. Please try again shortly.",
+    "1015": "Token is invalid.",
+    "1017": "Reference code is invalid.",
+    THROTTLED_CODE: "Too many requests have been made from this token. Please try again shortly.",
+    IN_PROGRESS_CODE: "Statement generation in progress. Please try again shortly.",
+    "1020": "Invalid request or unable to validate request.",
+}
+
+SERVLET_PATH = "/Universal/servlet"
+
+
+def _flex_error(code: str) -> str:
+    return (
+        "<FlexStatementResponse><Status>Warn</Status>"
+        f"<ErrorCode>{code}</ErrorCode><ErrorMessage>{ERROR_MESSAGES[code]}</ErrorMessage>"
+        "</FlexStatementResponse>"
+    )
+
+
+def build_statement(account_id: str, rows: int) -> str:
+    """
+    Builds a synthetic Flex statement with the given number of dividend rows.
+    Half of the rows are accruals and half are cash transactions, like a real
+    dividends query.
+
+    Args:
+        account_id (str): Account the statement belongs to.
+        rows (int): Number of dividend rows to include.
+
+    Returns:
+        str: Flex statement XML.
+    """
+    accruals = []
+    cash_transactions = []
+    for i in range(rows):
+        symbol = f"T{i:04d}"
+        day = 1 + i % 28
+        if i % 2 == 0:
+            accruals.append(
+                f'<ChangeInDividendAccrual currency="USD" fxRateToBase="0.92" symbol="{symbol}" '
+                f'description="TEST COMPANY {i}" date="202507{day:02d}" exDate="202506{day:02d}" '
+                f'payDate="202507{day:02d}" tax="-1.5" fee="0" grossAmount="-10" netAmount="-8.5" />'
+            )
+        else:
+            cash_transactions.append(
+                f'<CashTransaction symbol="{symbol}" dateTime="202507{day:02d}" amount="10" currency="USD" '
+                f'fxRateToBase="0.92" activityDescription="{symbol} Cash Dividend USD 0.25 per Share" />'
+            )
+    return (
+        '<FlexQueryResponse queryName="Load Test" type="AF"><FlexStatements count="1">'
+        f'<FlexStatement accountId="{account_id}" fromDate="20250701" toDate="20250728" '
+        'period="LastMonth" whenGenerated="20250729;080000">'
+        f'<ChangeInDividendAccruals>{"".join(accruals)}</ChangeInDividendAccruals>'
+        f'<CashTransactions>{"".join(cash_transactions)}</CashTransactions>'
+        "</FlexStatement></FlexStatements></FlexQueryResponse>"
+    )
+
+
+class FakeFlexServer:
+    """
+    Local stand-in for the IBKR Flex Web Service (SendRequest/GetStatement).
+
+    Args:
+        generation_delay (float): Seconds a statement stays "in progress".
+        error_rate (float): Probability (0-1) that a request fails with `error_code`.
+        error_code (str): Flex error code returned for injected failures.
+        throttle_per_second (int): Requests per token and second before answering
+            with error 1018. 0 disables throttling.
+        statement_rows (int): Dividend rows per generated statement.
+    """
+
+    def __init__(self, generation_delay=0.0, error_rate=0.0, error_code="1009",
+                 throttle_per_second=0, statement_rows=10, seed=None):
+        self.generation_delay = generation_delay
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.throttle_per_second = throttle_per_second
+        self.statement_rows = statement_rows
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._references: Dict[str, tuple] = {}
+        self._request_windows: Dict[str, List[float]] = {}
+        self._next_reference = 0
+        self.stats = {"send_request": 0, "get_statement": 0, "throttled": 0, "errors": 0}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{SERVLET_PATH}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _is_throttled(self, token: str) -> bool:
+        if not self.throttle_per_second:
+            return False
+        now = time.monotonic()
+        window = [t for t in self._request_windows.get(token, []) if now - t < 1.0]
+        throttled = len(window) >= self.throttle_per_second
+        if not throttled:
+            window.append(now)
+        self._request_windows[token] = window
+        return throttled
+
+    def handle(self, endpoint: str, params: Dict[str, str]) -> str:
+        """Returns the XML body the Flex Web Service would answer with."""
+        token = params.get("t", "")
+        with self._lock:
+            if self._is_throttled(token):
+                self.stats["throttled"] += 1
+                return _flex_error(THROTTLED_CODE)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return _flex_error(self.error_code)
+
+            if endpoint == "FlexStatementService.SendRequest":
+                self.stats["send_request"] += 1
+                if not token:
+                    return _flex_error("1015")
+                self._next_reference += 1
+                reference = str(1000000000 + self._next_reference)
+                self._references[reference] = (token, time.monotonic())
+                return (
+                    "<FlexStatementResponse><Status>Success</Status>"
+                    f"<ReferenceCode>{reference}</ReferenceCode>"
+                    f"<Url>{self.base_url}/FlexStatementService.GetStatement</Url>"
+                    "</FlexStatementResponse>"
+                )
+
+            if endpoint == "FlexStatementService.GetStatement":
+                self.stats["get_statement"] += 1
+                entry = self._references.get(params.get("q", ""))
+                if entry is None or entry[0] != token:
+                    return _flex_error("1017")
+                if time.monotonic() - entry[1] < self.generation_delay:
+                    return _flex_error(IN_PROGRESS_CODE)
+                # Like IBKR, a generated statement can be fetched again with the same reference code
+
+        if endpoint == "FlexStatementService.GetStatement":
+            return build_statement(f"U{zlib.crc32(token.encode()) % 10**7:07d}", self.statement_rows)
+        return _flex_error("1020")
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = fake.handle(url.path.rsplit("/", 1)[-1], params).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class SMTPSink:
+    """
+    Local SMTP server that accepts and discards every message.
+    It advertises AUTH (any credentials are accepted) but not STARTTLS, so
+    `send_dividend_email` has to run with SMTP_USE_TLS=false against it.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, size: int):
+        with self._lock:
+            self.messages += 1
+            self.bytes_received += size
+
+    def _make_handler(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+            def handle(self):
+                self.reply("220 localhost SMTP sink ready")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip().upper()
+                    if command.startswith("EHLO"):
+                        self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 52428800\r\n")
+                    elif command.startswith("AUTH LOGIN"):
+                        # Username and password prompts, both accepted as-is
+                        self.reply("334 VXNlcm5hbWU6")
+                        self.rfile.readline()
+                        self.reply("334 UGFzc3dvcmQ6")
+                        self.rfile.readline()
+                        self.reply("235 Authentication successful")
+                    elif command.startswith("AUTH"):
+                        self.reply("235 Authentication successful")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        size = 0
+                        for data_line in self.rfile:
+                            if data_line in (b".\r\n", b".\n"):
+                                break
+                            size += len(data_line)
+                        sink._record(size)
+                        self.reply("250 OK: queued")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        # HELO, MAIL, RCPT, RSET, NOOP
+                        self.reply("250 OK")
+
+        return Handler
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_load_test(accounts=200, concurrency=20, generation_delay=0.2, error_rate=0.0,
+                  error_code="1009", throttle_per_second=0, statement_rows=20,
+                  poll_interval=0.05, send_email=True, client_rate_limit=6000) -> Dict:
+    """
+    Drives `IBKRFlexQuery` and `send_dividend_email` against the local fakes
+    with one simulated account per token. Clients share a temporary rate
+    limiter database allowing `client_rate_limit` requests per minute and token,
+    and a temporary circuit breaker / latency database (so hedging is exercised).
+
+    Returns:
+        Dict: Throughput, latency percentiles (seconds) and error counters.
+    """
+    logger = logging.getLogger(__name__)
+    fetch_latencies = []
+    email_latencies = []
+    total_latencies = []
+    failures = []
+    limiter_waits = []
+    latencies_lock = threading.Lock()
+
+    with FakeFlexServer(generation_delay, error_rate, error_code, throttle_per_second,
+                        statement_rows) as flex_server, SMTPSink() as smtp_sink, \
+            tempfile.TemporaryDirectory() as limiter_dir:
+        limiter_db = os.path.join(limiter_dir, "rate_limiter.db")
+        resilience_db = os.path.join(limiter_dir, "resilience.db")
+        smtp_env = {
+            "SMTP_SERVER": smtp_sink.host,
+            "SMTP_PORT": str(smtp_sink.port),
+            "SMTP_USE_TLS": "false",
+            "SENDER_EMAIL": "loadtest@localhost",
+            "RECIPIENT_EMAIL": "sink@localhost",
+            "SMTP_USERNAME": "loadtest",
+            "SMTP_PASSWORD": "loadtest",
+        }
+        previous_env = {key: os.environ.get(key) for key in smtp_env}
+        os.environ.update(smtp_env)
+        today = datetime.now().strftime("%Y-%m-%d")
+
+        def simulate_account(index: int):
+            started = time.perf_counter()
+            token = f"loadtest-token-{index}"
+            rate_limiter = FlexRateLimiter(token, client_rate_limit, burst=5, db_path=limiter_db)
+            try:
+                client = IBKRFlexQuery(token, base_url=flex_server.base_url, poll_interval=poll_interval,
+                                       rate_limiter=rate_limiter,
+                                       circuit_breaker=CircuitBreaker(token, db_path=resilience_db),
+                                       latency_tracker=LatencyTracker(db_path=resilience_db))
+                dividends = parse_dividends(client.execute_query(f"query-{index}"))
+                fetched = time.perf_counter()
+                if send_email:
+                    send_dividend_email(dividends, today)
+                finished = time.perf_counter()
+            except Exception as e:
+                with latencies_lock:
+                    failures.append(str(e))
+                return
+            finally:
+                with latencies_lock:
+                    limiter_waits.append(rate_limiter.total_wait)
+                rate_limiter.close()
+            with latencies_lock:
+                fetch_latencies.append(fetched - started)
+                email_latencies.append(finished - fetched)
+                total_latencies.append(finished - started)
+
+        logger.info(f"Load test: {accounts} accounts, concurrency {concurrency}")
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(simulate_account, range(accounts)))
+        finally:
+            for key, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        elapsed = time.perf_counter() - started
+
+        results = {
+            "accounts": accounts,
+            "succeeded": len(total_latencies),
+            "failed": len(failures),
+            "elapsed": elapsed,
+            "throughput": len(total_latencies) / elapsed if elapsed else 0.0,
+            "emails_received": smtp_sink.messages,
+            "rate_limit_wait": sum(limiter_waits),
+            "server": dict(flex_server.stats),
+        }
+        for name, values in (("total", total_latencies), ("fetch", fetch_latencies), ("email", email_latencies)):
+            results[name] = {
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+                "max": max(values, default=0.0),
+            }
+        results["failure_samples"] = sorted(set(failures))[:5]
+    return results
+
+
+def _print_report(results: Dict):
+    print(f"Accounts:   {results['succeeded']}/{results['accounts']} succeeded, {results['failed']} failed")
+    print(f"Elapsed:    {results['elapsed']:.2f}s")
+    print(f"Throughput: {results['throughput']:.1f} accounts/s")
+    print(f"Emails:     {results['emails_received']} received by the SMTP sink")
+    print(f"Throttling: {results['rate_limit_wait']:.2f}s waited on the client rate limiter")
+    for name in ("total", "fetch", "email"):
+        stats = results[name]
+        print(f"{name:<6} latency  p50={stats['p50'] * 1000:.0f}ms  p95={stats['p95'] * 1000:.0f}ms  "
+              f"p99={stats['p99'] * 1000:.0f}ms  max={stats['max'] * 1000:.0f}ms")
+    print(f"Server:     {results['server']}")
+    for failure in results["failure_samples"]:
+        print(f"  failure: {failure}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test against local Flex Web Service and SMTP fakes")
+    parser.add_argument("--accounts", type=int, default=200, help="Simulated accounts (one token each)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Accounts processed in parallel")
+    parser.add_argument("--generation-delay", type=float, default=0.2, help="Seconds a statement stays in progress")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of an injected Flex error")
+    parser.add_argument("--error-code", default="1009", choices=sorted(ERROR_MESSAGES), help="Injected Flex error code")
+    parser.add_argument("--throttle", type=int, default=0, help="Requests per token and second before error 1018")
+    parser.add_argument("--rows", type=int, default=20, help="Dividend rows per statement")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Client GetStatement poll interval")
+    parser.add_argument("--client-rate-limit", type=float, default=6000,
+                        help="Client-side requests per minute and token (shared rate limiter)")
+    parser.add_argument("--no-email", action="store_true", help="Only exercise the Flex client")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    _print_report(run_load_test(
+        accounts=args.accounts,
+        concurrency=args.concurrency,
+        generation_delay=args.generation_delay,
+        error_rate=args.error_rate,
+        error_code=args.error_code,
+        throttle_per_second=args.throttle,
+        statement_rows=args.rows,
+        poll_interval=args.poll_interval,
+        send_email=not args.no_email,
+        client_rate_limit=args.client_rate_limit,
+    ))
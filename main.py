@@ -1,8 +1,16 @@
+import argparse
 import logging
+import sys
 from datetime import datetime
-from ibkr_client import get_all_dividends
-from email_sender import send_dividend_email
+from ibkr_client import commit_watermarks, get_all_dividends, fetch_dividends_statement, iter_dividends
+from notifiers import build_report, configured_sinks, dispatch_notifications
 from logger import setup_logger
+from profiler import enable_profiling, log_summary
+from dividend_store import DividendStore
+from forecast import payments_per_year, update_calendar, upcoming_dividends
+from positions import PositionIndex
+from exporters import EXPORT_FORMATS, EXPORTERS, export_dividends
+from reindex import reindex_statements
 from dotenv import load_dotenv
 import os
 
@@ -11,26 +19,150 @@ env_path = os.path.join(os.path.dirname(__file__), '.env')
 # Add override=True to ensure that the values from the .env file are always used
 load_dotenv(dotenv_path=env_path, override=True)
 
-def main():
+def update_dividend_calendar(dividends: list, today: str) -> tuple:
+    """
+    Adds the dividends to the local history, refreshes the calendar of the
+    tickers that changed and returns the payments expected in the next
+    DIVIDEND_CALENDAR_DAYS days (empty if the variable is not set), along
+    with the payments per year of every ticker with a known frequency.
+    """
+    logger = logging.getLogger(__name__)
+    # Example data must not end up in the history
+    if not os.getenv('IBKR_FLEX_TOKEN') or not os.getenv('IBKR_DIVIDENDS_QUERY_ID'):
+        return [], {}
+
+    try:
+        with DividendStore() as store:
+            update_calendar(store, store.add_dividends(dividends))
+            frequencies = payments_per_year(store)
+            calendar_days = os.getenv('DIVIDEND_CALENDAR_DAYS')
+            if not calendar_days:
+                return [], frequencies
+            upcoming = upcoming_dividends(store, int(calendar_days), today)
+            logger.info(f"{len(upcoming)} dividends expected in the next {calendar_days} days")
+            return upcoming, frequencies
+    except Exception as e:
+        logger.error(f"Error updating the dividend calendar: {str(e)}")
+        return [], {}
+
+def main(profile: bool = False) -> bool:
+    """Runs the dividend service. Returns False if the run failed."""
     setup_logger()
     logger = logging.getLogger(__name__)
     logger.info("Starting dividend service")
 
+    if profile:
+        # Writes one .pstats file and the top allocation sites per stage to logs/
+        enable_profiling("logs")
+
+    succeeded = True
     try:
         today = datetime.now().strftime("%Y-%m-%d")  # Expected format by the email function
         
-        # Get all dividends from IBKR
-        dividends = get_all_dividends()
-        logger.info(f"Obtained {len(dividends)} dividends from IBKR")
+        # Get all dividends from IBKR, and the open positions of the same statement if the query includes them
+        positions = PositionIndex()
+        pending_watermarks = []
+        dividends = get_all_dividends(positions, pending_watermarks)
+        logger.info(f"Obtained {len(dividends)} dividends and {len(positions)} open positions from IBKR")
+
+        upcoming, frequencies = update_dividend_calendar(dividends, today)
 
         if dividends:
-            send_dividend_email(dividends, today)
-            logger.info("Dividend email sent successfully")
+            # Aggregated once and shared by every configured sink (email, Telegram, webhook)
+            report = build_report(dividends, today, upcoming, positions, frequencies)
+            results = dispatch_notifications(configured_sinks(), report)
+            # Until a sink delivers the report, the watermark stays put and the same days are requested again
+            if any(results.values()):
+                commit_watermarks(pending_watermarks)
+            elif results:
+                logger.error("No notification sink delivered the report")
+                succeeded = False
         else:
-            logger.info("No dividends found in XML. No email sent.")
+            logger.info("No dividends found in XML. No notification sent.")
+            commit_watermarks(pending_watermarks)
             
     except Exception as e:
         logger.error(f"Error in dividend service: {str(e)}")
+        succeeded = False
+
+    if profile:
+        log_summary()
+    return succeeded
+
+def export(export_format: str, output: str = None, batch_size: int = 10000) -> bool:
+    """
+    Streams the dividends of the Flex Query to a file or stdout, without
+    sending the email.
+
+    Args:
+        export_format (str): jsonl, csv or parquet.
+        output (str): Output file; stdout if not given.
+        batch_size (int): Records per batch (Parquet row group size).
+
+    Returns:
+        bool: True if the export finished.
+    """
+    setup_logger()
+    logger = logging.getLogger(__name__)
+
+    token = os.getenv('IBKR_FLEX_TOKEN')
+    query_id = os.getenv('IBKR_DIVIDENDS_QUERY_ID')
+    if not token or not query_id:
+        logger.error("Token or Query ID not configured, nothing to export")
+        return False
+
+    try:
+        records = iter_dividends(fetch_dividends_statement(token, query_id))
+        binary = EXPORTERS[export_format].binary
+        if output:
+            mode = "wb" if binary else "w"
+            with open(output, mode, **({} if binary else {"encoding": "utf-8", "newline": ""})) as stream:
+                export_dividends(records, export_format, stream, batch_size)
+        else:
+            export_dividends(records, export_format, sys.stdout.buffer if binary else sys.stdout, batch_size)
+        return True
+    except Exception as e:
+        logger.error(f"Error exporting dividends: {str(e)}")
+        return False
+
+def reindex(workers: int = None, batch_size: int = 5000, rebuild: bool = False) -> bool:
+    """
+    Rebuilds the local history and calendar from the archived Flex statements.
+
+    Returns:
+        bool: True if every statement was reindexed.
+    """
+    setup_logger()
+    logger = logging.getLogger(__name__)
+    try:
+        results = reindex_statements(workers=workers, batch_size=batch_size, rebuild=rebuild)
+        return results["failed"] == 0
+    except Exception as e:
+        logger.error(f"Error reindexing statements: {str(e)}")
+        return False
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="IBKR dividend email notifier")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile each pipeline stage (cProfile + tracemalloc) and write the results to logs/")
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="Stream the dividends as JSON Lines, CSV or Parquet")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl", help="Output format")
+    export_parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    export_parser.add_argument("--batch-size", type=int, default=10000,
+                               help="Records per batch (Parquet row group size)")
+    reindex_parser = subparsers.add_parser("reindex", help="Rebuild the local history from the archived statements")
+    reindex_parser.add_argument("--workers", type=int, help="Parser processes (default: number of CPU cores)")
+    reindex_parser.add_argument("--batch-size", type=int, default=5000, help="Records per insert transaction")
+    reindex_parser.add_argument("--rebuild", action="store_true",
+                                help="Delete the existing history before loading")
+    args = parser.parse_args()
+    if args.profile and args.command:
+        parser.error(f"--profile only applies to the daily run, not to the {args.command} command")
+
+    if args.command == "export":
+        sys.exit(0 if export(args.format, args.output, args.batch_size) else 1)
+    if args.command == "reindex":
+        sys.exit(0 if reindex(args.workers, args.batch_size, args.rebuild) else 1)
+    # A non-zero exit code makes IBKR outages visible in cron and GitHub Actions
+    sys.exit(0 if main(profile=args.profile) else 1)
\ No newline at end of file
@@ -0,0 +1,120 @@
+from operator import itemgetter
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+# Amounts are int64 micro-units (1e-6 of the currency unit). Flex amounts and
+# FX rates have at most 6 decimals, so they are represented exactly.
+SCALE = 1_000_000
+# Base-currency amounts are rounded to cents, in micro-units
+CENT = SCALE // 100
+# Largest float amount that converts to micro-units exactly (2**53 / SCALE)
+_MAX_EXACT = 2 ** 53 / SCALE
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def to_micros(values: Iterable[float]) -> np.ndarray:
+    """
+    Converts amounts to int64 micro-units.
+
+    Raises:
+        ValueError: If an amount is too large to be converted exactly.
+    """
+    floats = np.asarray(values, dtype=np.float64)
+    if floats.size and np.abs(floats).max() >= _MAX_EXACT:
+        raise ValueError("Amount too large to be represented in micro-units")
+    return np.rint(floats * SCALE).astype(np.int64)
+
+
+def to_float(micros) -> float:
+    """Returns micro-units as a float for display and JSON output."""
+    return int(micros) / SCALE
+
+
+def round_half_even(numerators: np.ndarray, divisor: int) -> np.ndarray:
+    """
+    Divides integers rounding half to even (banker's rounding), the only
+    rounding policy used for money. Works on int64 and on object arrays of
+    Python ints.
+    """
+    quotients, remainders = numerators // divisor, numerators % divisor
+    # Floor division leaves 0 <= remainder < divisor, also for negative amounts
+    twice = remainders * 2
+    round_up = (twice > divisor) | ((twice == divisor) & (quotients % 2 == 1))
+    return quotients + round_up
+
+
+def convert(amounts: np.ndarray, rates: np.ndarray) -> np.ndarray:
+    """
+    Converts micro-unit amounts with micro-unit FX rates, rounding every
+    converted amount to cents.
+
+    Returns:
+        np.ndarray: Converted amounts in micro-units, multiples of CENT.
+    """
+    if amounts.size and int(np.abs(amounts).max()) * int(np.abs(rates).max()) > _INT64_MAX:
+        # The products would overflow int64: use Python integers, still exact
+        amounts, rates = amounts.astype(object), rates.astype(object)
+    # amount * rate is scaled by SCALE**2; dividing by SCALE * CENT leaves cents
+    return round_half_even(amounts * rates, SCALE * CENT) * CENT
+
+
+def _column(dividends: List[Dict], key: str, dtype, default=None) -> np.ndarray:
+    """Extracts one field of every record into an array, using `default` where it is missing."""
+    try:
+        return np.fromiter(map(itemgetter(key), dividends), dtype, len(dividends))
+    except KeyError:
+        if default is None:
+            raise
+        return np.fromiter((d.get(key, default) for d in dividends), dtype, len(dividends))
+
+
+class DividendAmounts:
+    """
+    Money columns of a list of dividends: absolute amounts in the dividend
+    currency and converted to the base currency, as int64 micro-units.
+    Built once per report, so totals and per-row conversions are computed in
+    batch instead of once per row and consumer.
+
+    Args:
+        dividends (List[Dict]): Records as returned by `get_all_dividends`.
+    """
+
+    def __init__(self, dividends: List[Dict]):
+        self.currencies = _column(dividends, "currency", object, "")
+        self.fx_rates = to_micros(_column(dividends, "fxRateToBase", np.float64, 1))
+        self.gross = np.abs(to_micros(_column(dividends, "dividendo_bruto", np.float64)))
+        self.tax = np.abs(to_micros(_column(dividends, "tax", np.float64)))
+        self.net = np.abs(to_micros(_column(dividends, "netAmount", np.float64)))
+        self.gross_base = convert(self.gross, self.fx_rates)
+        self.tax_base = convert(self.tax, self.fx_rates)
+        self.net_base = convert(self.net, self.fx_rates)
+
+    def __len__(self):
+        return len(self.currencies)
+
+    def totals(self) -> Dict[str, int]:
+        """Returns the base-currency totals in micro-units; exact sums of the rounded rows."""
+        return {
+            "gross": int(self.gross_base.sum()),
+            "tax": int(self.tax_base.sum()),
+            "net": int(self.net_base.sum()),
+        }
+
+    def exchange_rates(self) -> Dict[str, float]:
+        """Returns the first FX rate seen for each currency, in order of appearance."""
+        # Walking the rows backwards, the first occurrence of each currency is written last
+        first_rows = dict(zip(self.currencies[::-1].tolist(), range(len(self) - 1, -1, -1)))
+        return {
+            currency: to_float(self.fx_rates[row])
+            for currency, row in sorted(first_rows.items(), key=itemgetter(1))
+            if currency
+        }
+
+    def base_columns(self) -> tuple:
+        """Returns the gross, tax and net base-currency amounts per dividend, as lists of floats for display."""
+        return (
+            (self.gross_base / SCALE).tolist(),
+            (self.tax_base / SCALE).tolist(),
+            (self.net_base / SCALE).tolist(),
+        )
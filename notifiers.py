@@ -0,0 +1,244 @@
+import html
+import logging
+import os
+import smtplib
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from email_sender import EmailConfigError, _aggregate_dividends, _get_dates_string, send_report_email
+from profiler import profile_stage
+
+# Telegram rejects messages longer than this
+TELEGRAM_MAX_LENGTH = 4096
+
+
+def build_report(dividends: List[Dict], date: str, upcoming: Optional[List[Dict]] = None, positions=None,
+                 payments_per_year: Optional[Dict[str, int]] = None) -> Dict:
+    """
+    Aggregates the dividends once; every sink renders its own format from
+    the same report.
+
+    Args:
+        dividends (List[Dict]): List of dividends.
+        date (str): Reference date in YYYY-MM-DD format, used as a fallback.
+        upcoming (Optional[List[Dict]]): Expected payments from the dividend calendar.
+        positions (Optional[PositionIndex]): Open positions of the statement, for the yield on cost.
+        payments_per_year (Optional[Dict[str, int]]): Payment frequency per ticker, for the annualized yield.
+
+    Returns:
+        Dict: dividends, date, dates_str, summary, upcoming and stale (date
+        of the cached statement used when IBKR was unavailable, else None).
+    """
+    with profile_stage("aggregate"):
+        summary = _aggregate_dividends(dividends, positions, payments_per_year)
+    return {
+        "dividends": dividends,
+        "date": date,
+        "dates_str": _get_dates_string(dividends, date),
+        "summary": summary,
+        "upcoming": upcoming or [],
+        "stale": summary["stale"],
+    }
+
+
+class PermanentSinkError(Exception):
+    """A delivery error that retrying will not fix (bad configuration, 4xx)."""
+
+
+class NotificationSink(ABC):
+    """
+    Base class for notification channels. Subclasses implement `send`;
+    `deliver` adds the retry policy.
+
+    Args:
+        timeout (float): Timeout in seconds of each delivery attempt.
+        retries (int): Extra attempts after a failed one.
+        backoff (float): Seconds before the first retry, doubled on each retry.
+    """
+
+    name = "sink"
+
+    def __init__(self, timeout: float = 10.0, retries: int = 2, backoff: float = 1.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    @abstractmethod
+    def send(self, report: Dict):
+        """Sends the report once; raises on failure."""
+
+    def deliver(self, report: Dict) -> bool:
+        """Sends the report, retrying transient errors. Returns True on success."""
+        logger = logging.getLogger(__name__)
+        for attempt in range(self.retries + 1):
+            try:
+                self.send(report)
+                logger.info(f"Notification sent via {self.name}")
+                return True
+            except PermanentSinkError as e:
+                logger.error(f"Error sending notification via {self.name}: {str(e)}")
+                return False
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Error sending notification via {self.name} after {attempt + 1} attempts: {str(e)}")
+                    return False
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"Error sending notification via {self.name}, retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+        return False
+
+
+def _post_json(url: str, payload: Dict, timeout: float):
+    response = requests.post(url, json=payload, timeout=timeout)
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        raise PermanentSinkError(f"HTTP {response.status_code}: {response.text[:200]}")
+    response.raise_for_status()
+    return response
+
+
+class EmailSink(NotificationSink):
+    """Sends the HTML email through SMTP (see `send_report_email`)."""
+
+    name = "email"
+
+    def send(self, report: Dict):
+        try:
+            send_report_email(report["dividends"], report["dates_str"], report["summary"],
+                              report["upcoming"], timeout=self.timeout)
+        except (EmailConfigError, smtplib.SMTPAuthenticationError) as e:
+            raise PermanentSinkError(str(e))
+
+
+class TelegramSink(NotificationSink):
+    """
+    Sends a text summary through the Telegram Bot API `sendMessage` method.
+
+    Args:
+        bot_token (str): Bot token from @BotFather.
+        chat_id (str): Chat that receives the message.
+        api_url (str): Bot API base URL; can point to a local stand-in.
+    """
+
+    name = "telegram"
+
+    def __init__(self, bot_token: str, chat_id: str, api_url: str = "https://api.telegram.org", **kwargs):
+        super().__init__(**kwargs)
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip("/")
+
+    def render(self, report: Dict) -> str:
+        summary = report["summary"]
+        lines = [
+            f"<b>💰 Dividends {html.escape(report['dates_str'])}</b>",
+            f"Gross: €{summary['total_gross_eur']:.2f} • Taxes: €{summary['total_tax_eur']:.2f} • "
+            f"Net: €{summary['total_net_eur']:.2f}",
+            "",
+        ]
+        if report.get("stale"):
+            lines.insert(1, f"⚠️ IBKR unavailable, cached statement from {html.escape(report['stale'])}")
+        for d in report["dividends"]:
+            lines.append(f"{html.escape(d['ticker'] or '')}: {abs(d['netAmount']):.2f} {html.escape(d.get('currency') or '')}")
+        if report["upcoming"]:
+            lines.append("")
+            lines.append("<b>Upcoming</b>")
+            for entry in report["upcoming"]:
+                lines.append(f"{html.escape(entry['ticker'])}: {entry['next_pay_date']} "
+                             f"(~{entry['last_amount']:.2f} {html.escape(entry['currency'])})")
+
+        text = "\n".join(lines)
+        if len(text) > TELEGRAM_MAX_LENGTH:
+            # Cut at a line boundary so no HTML tag is left open
+            text = text[:TELEGRAM_MAX_LENGTH - 20].rsplit("\n", 1)[0] + "\n…"
+        return text
+
+    def send(self, report: Dict):
+        _post_json(
+            f"{self.api_url}/bot{self.bot_token}/sendMessage",
+            {"chat_id": self.chat_id, "text": self.render(report), "parse_mode": "HTML"},
+            self.timeout,
+        )
+
+
+class WebhookSink(NotificationSink):
+    """
+    POSTs the report as JSON to a generic webhook.
+
+    Args:
+        url (str): Webhook URL.
+    """
+
+    name = "webhook"
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+
+    def render(self, report: Dict) -> Dict:
+        summary = report["summary"]
+        return {
+            "date": report["date"],
+            "dates": report["dates_str"],
+            "totals_eur": {
+                "gross": round(summary["total_gross_eur"], 2),
+                "tax": round(summary["total_tax_eur"], 2),
+                "net": round(summary["total_net_eur"], 2),
+            },
+            "exchange_rates": summary["exchange_rates"],
+            "positions": summary.get("positions", []),
+            "dividends": report["dividends"],
+            "upcoming": report["upcoming"],
+            "stale": report.get("stale"),
+        }
+
+    def send(self, report: Dict):
+        _post_json(self.url, self.render(report), self.timeout)
+
+
+def _sink_policy(prefix: str) -> Dict:
+    return {
+        "timeout": float(os.getenv(f"{prefix}_TIMEOUT", "10")),
+        "retries": int(os.getenv(f"{prefix}_RETRIES", "2")),
+        "backoff": float(os.getenv(f"{prefix}_BACKOFF", "1")),
+    }
+
+
+def configured_sinks() -> List[NotificationSink]:
+    """Creates the sinks configured in the environment variables."""
+    sinks = []
+    if os.getenv('RECIPIENT_EMAIL'):
+        sinks.append(EmailSink(**_sink_policy("SMTP")))
+    if os.getenv('TELEGRAM_BOT_TOKEN') and os.getenv('TELEGRAM_CHAT_ID'):
+        sinks.append(TelegramSink(
+            os.getenv('TELEGRAM_BOT_TOKEN'),
+            os.getenv('TELEGRAM_CHAT_ID'),
+            os.getenv('TELEGRAM_API_URL', "https://api.telegram.org"),
+            **_sink_policy("TELEGRAM"),
+        ))
+    if os.getenv('WEBHOOK_URL'):
+        sinks.append(WebhookSink(os.getenv('WEBHOOK_URL'), **_sink_policy("WEBHOOK")))
+    return sinks
+
+
+def dispatch_notifications(sinks: List[NotificationSink], report: Dict) -> Dict[str, bool]:
+    """
+    Delivers the report to all sinks concurrently, so a slow or failing
+    sink does not delay the others.
+
+    Returns:
+        Dict[str, bool]: Delivery result by sink name.
+    """
+    logger = logging.getLogger(__name__)
+    if not sinks:
+        logger.warning("No notification sinks configured")
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(sinks)) as executor:
+        futures = {sink.name: executor.submit(sink.deliver, report) for sink in sinks}
+    results = {name: future.result() for name, future in futures.items()}
+    logger.info(f"Notifications delivered: {results}")
+    return results
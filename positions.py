@@ -0,0 +1,126 @@
+from typing import Dict, List, Optional
+
+from dividend_store import _iso_date
+from money import DividendAmounts, convert, to_float, to_micros
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class PositionIndex:
+    """
+    Open positions of a Flex statement (OpenPositions section), hashed by
+    (account, conid) and (account, symbol), so each dividend finds its
+    position in constant time. Filled by `iter_dividends` in the same pass
+    that yields the dividends.
+    """
+
+    def __init__(self):
+        self._by_conid: Dict[tuple, Dict] = {}
+        self._by_symbol: Dict[tuple, Dict] = {}
+
+    def __len__(self):
+        return len(self.positions())
+
+    def add(self, attributes: Dict, account_id: str = ""):
+        """
+        Indexes an OpenPosition element. Lot rows are skipped; only the
+        summary row of each position is used.
+
+        Args:
+            attributes (Dict): OpenPosition attributes.
+            account_id (str): Account of the enclosing FlexStatement, used if the row has none.
+        """
+        if (attributes.get("levelOfDetail") or "SUMMARY").upper() != "SUMMARY":
+            return
+        account = attributes.get("accountId") or account_id or ""
+        position = {
+            "accountId": account,
+            "conid": attributes.get("conid", ""),
+            "symbol": attributes.get("symbol", ""),
+            "description": attributes.get("description", ""),
+            "currency": attributes.get("currency", ""),
+            "quantity": _float(attributes.get("position")),
+            "costBasisMoney": abs(_float(attributes.get("costBasisMoney"))),
+            "fxRateToBase": _float(attributes.get("fxRateToBase")) or 1.0,
+        }
+        if position["conid"]:
+            self._by_conid[(account, position["conid"])] = position
+        if position["symbol"]:
+            self._by_symbol[(account, position["symbol"])] = position
+
+    def lookup(self, account_id: str, conid: str, symbol: str) -> Optional[Dict]:
+        """Returns the position of a dividend, matched by conid first and by symbol otherwise."""
+        account = account_id or ""
+        if conid:
+            position = self._by_conid.get((account, conid))
+            if position is not None:
+                return position
+        return self._by_symbol.get((account, symbol)) if symbol else None
+
+    def positions(self) -> List[Dict]:
+        unique = {id(p): p for p in self._by_conid.values()}
+        unique.update((id(p), p) for p in self._by_symbol.values())
+        return list(unique.values())
+
+
+def position_yields(dividends: List[Dict], amounts: DividendAmounts, positions: PositionIndex,
+                    payments_per_year: Optional[Dict[str, int]] = None) -> List[Dict]:
+    """
+    Joins the dividends with the open positions and calculates the yield on
+    cost of every position that received dividends.
+
+    Accruals, their reversals and cash transactions of the same payment share
+    the pay date, so each payment counts once, like in the dividend history.
+
+    Args:
+        dividends (List[Dict]): List of dividends.
+        amounts (DividendAmounts): Their amounts, already converted to EUR.
+        positions (PositionIndex): Open positions of the same statement.
+        payments_per_year (Optional[Dict[str, int]]): Payment frequency per ticker,
+            from the dividend calendar; without it the annualized yield is None.
+
+    Returns:
+        List[Dict]: One entry per position, by ticker: accountId, ticker, currency,
+        quantity, payments, cost_basis_eur, dividends_eur, yield_on_cost and
+        annualized_yield (fractions; None when they cannot be calculated).
+    """
+    payments_per_year = payments_per_year or {}
+    received = {}  # id(position) -> (position, {pay date: EUR micro-units})
+    for dividend, gross in zip(dividends, amounts.gross_base.tolist()):
+        position = positions.lookup(dividend.get("accountId"), dividend.get("conid"), dividend.get("ticker"))
+        if position is None:
+            continue
+        _, payments = received.setdefault(id(position), (position, {}))
+        pay_date = _iso_date(dividend.get("payDate", "")) or dividend.get("fecha") or ""
+        payments[pay_date] = max(payments.get(pay_date, 0), gross)
+
+    matched = list(received.values())
+    cost_basis = convert(
+        to_micros([position["costBasisMoney"] for position, _ in matched]),
+        to_micros([position["fxRateToBase"] for position, _ in matched]),
+    ).tolist()
+
+    yields = []
+    for (position, payments), cost in zip(matched, cost_basis):
+        received_eur = sum(payments.values())
+        per_year = payments_per_year.get(position["symbol"], 0)
+        yield_on_cost = received_eur / cost if cost else None
+        annualized = received_eur / len(payments) * per_year / cost if cost and per_year else None
+        yields.append({
+            "accountId": position["accountId"],
+            "ticker": position["symbol"],
+            "currency": position["currency"],
+            "quantity": position["quantity"],
+            "payments": len(payments),
+            "cost_basis_eur": to_float(cost),
+            "dividends_eur": to_float(received_eur),
+            "yield_on_cost": yield_on_cost,
+            "annualized_yield": annualized,
+        })
+    yields.sort(key=lambda entry: (entry["ticker"], entry["accountId"]))
+    return yields
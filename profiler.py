@@ -0,0 +1,143 @@
+import cProfile
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Allocations made by tracemalloc itself are not interesting
+_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+# Profiler of the current run; None when profiling is off, so `profile_stage`
+# only costs one global lookup per pipeline stage.
+_active_profiler = None
+_NULL_CONTEXT = nullcontext()
+
+
+class StageProfiler:
+    """
+    Collects cProfile statistics and tracemalloc allocations per pipeline stage
+    (fetch, parse, aggregate, render, send).
+
+    Args:
+        output_dir (str): Directory where .pstats and allocation files are written.
+        top_allocations (int): Number of allocation sites kept per stage.
+    """
+
+    def __init__(self, output_dir: str = "logs", top_allocations: int = 10):
+        self.output_dir = output_dir
+        self.top_allocations = top_allocations
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.results: List[Dict] = []
+        self._running: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        # Nested stages are folded into the outer one: only one cProfile
+        # profiler can be active at a time.
+        if self._running is not None:
+            yield
+            return
+
+        self._running = name
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            self._running = None
+            self._save_stage(name, profile, elapsed, peak, after.compare_to(before, "lineno"))
+
+    def _save_stage(self, name, profile, elapsed, peak, allocation_diff):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"profile_{self.run_id}_{name}")
+
+        stats_file = f"{prefix}.pstats"
+        profile.dump_stats(stats_file)
+
+        allocations = [stat for stat in allocation_diff if stat.size_diff > 0][:self.top_allocations]
+        allocations_file = f"{prefix}_allocations.txt"
+        with open(allocations_file, "w", encoding="utf-8") as f:
+            f.write(f"Top {len(allocations)} allocation sites for stage '{name}' (peak {peak / 1024:.1f} KiB)\n")
+            for stat in allocations:
+                f.write(f"{stat}\n")
+
+        stats = pstats.Stats(profile)
+        hot_spots = []
+        for (filename, line, function), (_, _, tottime, _, _) in sorted(
+                stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:3]:
+            hot_spots.append(f"{os.path.basename(filename)}:{line}({function}) {tottime * 1000:.1f}ms")
+
+        self.results.append({
+            "stage": name,
+            "elapsed": elapsed,
+            "peak_memory": peak,
+            "hot_spots": hot_spots,
+            "top_allocation": str(allocations[0]) if allocations else "",
+            "stats_file": stats_file,
+            "allocations_file": allocations_file,
+        })
+
+    def summary(self) -> str:
+        """Returns a short hot-spot summary of all profiled stages."""
+        lines = ["Profiling summary:"]
+        for result in self.results:
+            lines.append(
+                f"  {result['stage']:<10} {result['elapsed'] * 1000:8.1f}ms  "
+                f"peak {result['peak_memory'] / 1024:8.1f} KiB"
+            )
+            for hot_spot in result["hot_spots"]:
+                lines.append(f"      {hot_spot}")
+            if result["top_allocation"]:
+                lines.append(f"      top allocation: {result['top_allocation']}")
+        if self.results:
+            lines.append(f"  Profiles written to {self.output_dir}/profile_{self.run_id}_*")
+        else:
+            lines.append("  No pipeline stage was profiled")
+        return "\n".join(lines)
+
+
+def enable_profiling(output_dir: str = "logs") -> StageProfiler:
+    """Starts tracemalloc and activates stage profiling for the current run."""
+    global _active_profiler
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active_profiler = StageProfiler(output_dir)
+    return _active_profiler
+
+
+def disable_profiling():
+    global _active_profiler
+    _active_profiler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def profile_stage(name: str):
+    """
+    Context manager wrapping a pipeline stage. It is a shared no-op context
+    unless `enable_profiling` was called.
+
+    Args:
+        name (str): Stage name, used in the output file names.
+    """
+    if _active_profiler is None:
+        return _NULL_CONTEXT
+    return _active_profiler.stage(name)
+
+
+def log_summary():
+    """Logs the summary of the active profiler (console and log file), if any."""
+    if _active_profiler is None:
+        return
+    logging.getLogger(__name__).info(_active_profiler.summary())
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+DEFAULT_DB_PATH = os.path.join("data", "rate_limiter.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS waits (
+    key TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    waited REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_waits_key ON waits (key, recorded_at);
+"""
+
+
+class FlexRateLimiter:
+    """
+    Token bucket shared by every process on the host through a SQLite file,
+    with one bucket per Flex token. IBKR throttles the Flex Web Service per
+    token, so all `IBKRFlexQuery` instances using the same token share the budget.
+
+    Args:
+        token (str): Flex Web Service token; only its hash is stored.
+        requests_per_minute (float): Sustained request rate.
+        burst (int): Maximum number of requests allowed back to back.
+        db_path (str): SQLite file shared by the processes.
+        wait_window (int): Number of recent waits kept per token for `wait_stats`.
+    """
+
+    def __init__(self, token: str, requests_per_minute: float = None, burst: int = None, db_path: str = None,
+                 wait_window: int = 1000):
+        self.key = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+        self.rate = (requests_per_minute or float(os.getenv("IBKR_RATE_LIMIT_PER_MINUTE", "10"))) / 60.0
+        self.capacity = burst or int(os.getenv("IBKR_RATE_LIMIT_BURST", "3"))
+        self.db_path = db_path or os.getenv("IBKR_RATE_LIMIT_DB", DEFAULT_DB_PATH)
+        self.wait_window = wait_window
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        # The connection is shared by the threads of this instance (hedged requests)
+        self._lock = threading.Lock()
+        self.total_wait = 0.0
+
+    def close(self):
+        # An abandoned hedged request may still be using the connection
+        with self._lock:
+            self.conn.close()
+
+    def _reserve(self) -> float:
+        """
+        Takes one request from the bucket if possible.
+
+        Returns:
+            float: 0 if the request was granted, otherwise the seconds to wait
+            before trying again.
+        """
+        with self._lock:
+            return self._reserve_locked()
+
+    def _reserve_locked(self) -> float:
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock, serializing all processes
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            if row is None:
+                tokens, blocked_until = float(self.capacity), 0.0
+            else:
+                tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                blocked_until = row[2]
+
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self.conn.execute(
+                "INSERT INTO buckets (key, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (self.key, tokens, now, blocked_until),
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def try_acquire(self) -> bool:
+        """Takes one request from the bucket only if it is available right now, without waiting."""
+        return self._reserve() <= 0
+
+    def acquire(self) -> float:
+        """
+        Blocks until a request is allowed for this token.
+
+        Returns:
+            float: Seconds this caller waited.
+        """
+        waited = 0.0
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            waited += wait
+
+        if waited > 0:
+            with self._lock:
+                self.total_wait += waited
+                self.conn.execute(
+                    "INSERT INTO waits (key, pid, waited, recorded_at) VALUES (?, ?, ?, ?)",
+                    (self.key, os.getpid(), waited, time.time()),
+                )
+                # Keep only the window of recent waits
+                self.conn.execute(
+                    "DELETE FROM waits WHERE key = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM waits WHERE key = ? ORDER BY recorded_at DESC LIMIT ?)",
+                    (self.key, self.key, self.wait_window),
+                )
+            logging.getLogger(__name__).info(f"Waited {waited:.2f}s for the Flex request budget")
+        return waited
+
+    def penalize(self, attempt: int, base_delay: float = 5.0, max_delay: float = 120.0) -> float:
+        """
+        Blocks the bucket for every process after a throttling response, with
+        exponential backoff on the caller's consecutive throttling responses.
+
+        Args:
+            attempt (int): Consecutive throttling responses seen by the caller (0-based).
+
+        Returns:
+            float: Backoff applied, in seconds.
+        """
+        delay = min(max_delay, base_delay * (2 ** attempt))
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at, "
+                    "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                    (self.key, now, now + delay),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        logging.getLogger(__name__).warning(f"Flex requests throttled by IBKR, backing off {delay:.0f}s")
+        return delay
+
+    def wait_stats(self) -> Dict:
+        """Returns how many of the recent callers had to wait for this token and for how long."""
+        with self._lock:
+            count, total, longest = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(waited), 0), COALESCE(MAX(waited), 0) FROM waits WHERE key = ?",
+                (self.key,),
+            ).fetchone()
+        return {"waits": count, "total_wait": total, "max_wait": longest}
@@ -0,0 +1,99 @@
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from dividend_store import DividendStore
+from forecast import update_calendar
+from ibkr_client import iter_dividends
+from statement_archive import StatementArchive
+
+
+def parse_archived_statement(path: str) -> Tuple[str, List[Dict]]:
+    """
+    Parses one archived statement through a read-only memory map, so the
+    file is paged in by the OS instead of being copied into a Python string.
+    Runs in the worker processes.
+
+    Returns:
+        Tuple[str, List[Dict]]: The path and its dividend records.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return path, []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return path, list(iter_dividends(mapped))
+
+
+def reindex_statements(archive: StatementArchive = None, store: DividendStore = None, workers: int = None,
+                       batch_size: int = 5000, rebuild: bool = False) -> Dict:
+    """
+    Re-parses every archived Flex statement in parallel and bulk-loads the
+    records into the local store, then recomputes the dividend calendar.
+
+    Args:
+        archive (StatementArchive): Archived statements; the default archive if not given.
+        store (DividendStore): Destination store; the default store if not given.
+        workers (int): Worker processes; defaults to the number of CPU cores.
+        batch_size (int): Records per insert; each batch is its own transaction unless rebuilding.
+        rebuild (bool): Replace the existing history with the archived statements.
+            The deletion and the load are one transaction, committed only if
+            every statement was parsed, so a failed rebuild leaves the history intact.
+
+    Returns:
+        Dict: Number of statements, failed statements, records parsed and records inserted.
+
+    Raises:
+        Exception: If a rebuild was rolled back because some statements could not be parsed.
+    """
+    logger = logging.getLogger(__name__)
+    archive = archive or StatementArchive()
+    own_store = store is None
+    store = store or DividendStore()
+    workers = workers or os.cpu_count() or 1
+    paths = archive.paths()
+    results = {"statements": len(paths), "failed": 0, "parsed": 0, "inserted": 0}
+    started = time.perf_counter()
+
+    try:
+        if rebuild:
+            store.clear(commit=False)
+        logger.info(f"Reindexing {len(paths)} statements with {workers} workers")
+
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(parse_archived_statement, path) for path in paths]
+            for future in futures:
+                try:
+                    path, records = future.result()
+                except Exception as e:
+                    results["failed"] += 1
+                    logger.error(f"Error parsing archived statement: {str(e)}")
+                    continue
+                results["parsed"] += len(records)
+                batch.extend(records)
+                if len(batch) >= batch_size:
+                    results["inserted"] += store.bulk_add_dividends(batch, commit=not rebuild)
+                    batch = []
+        if batch:
+            results["inserted"] += store.bulk_add_dividends(batch, commit=not rebuild)
+
+        if rebuild and results["failed"]:
+            raise Exception(f"{results['failed']} statements could not be parsed, the history was not rebuilt")
+        # Also commits the rebuild, in the same transaction as the deletion
+        update_calendar(store, store.tickers())
+    except BaseException:
+        store.conn.rollback()
+        raise
+    finally:
+        if own_store:
+            store.close()
+
+    results["elapsed"] = time.perf_counter() - started
+    logger.info(
+        f"Reindexed {results['statements']} statements ({results['failed']} failed): "
+        f"{results['parsed']} records parsed, {results['inserted']} new in {results['elapsed']:.2f}s"
+    )
+    return results
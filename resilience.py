@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+DEFAULT_DB_PATH = os.path.join("data", "resilience.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    key TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL,
+    opened_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latencies (
+    endpoint TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_latencies_endpoint ON latencies (endpoint, recorded_at);
+"""
+
+
+def _connect(db_path: Optional[str], **kwargs) -> sqlite3.Connection:
+    db_path = db_path or os.getenv("IBKR_RESILIENCE_DB", DEFAULT_DB_PATH)
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, **kwargs)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class CircuitOpenError(Exception):
+    """Raised without contacting IBKR while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker persisted in SQLite, so consecutive runs (cron, workers)
+    see the same state. After `failure_threshold` consecutive failures the
+    circuit opens for `cooldown` seconds and calls fail immediately. After the
+    cooldown, the first caller on the host claims a trial call (half-open) and
+    the others keep failing until the trial records its result, or until
+    `trial_timeout` passes if the trial never does.
+
+    Args:
+        token (str): Flex token; only its hash is stored.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        cooldown (float): Seconds the circuit stays open.
+        db_path (str): SQLite file shared by the processes.
+        trial_timeout (float): Seconds other callers wait for the trial call.
+    """
+
+    def __init__(self, token: str, failure_threshold: int = None, cooldown: float = None, db_path: str = None,
+                 trial_timeout: float = 300):
+        self.key = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+        self.failure_threshold = failure_threshold or int(os.getenv("IBKR_CIRCUIT_FAILURES", "3"))
+        self.cooldown = cooldown or float(os.getenv("IBKR_CIRCUIT_COOLDOWN", "900"))
+        self.trial_timeout = trial_timeout
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = _connect(db_path, isolation_level=None)
+
+    def _state(self):
+        row = self.conn.execute(
+            "SELECT failures, opened_until FROM circuit_breakers WHERE key = ?", (self.key,)
+        ).fetchone()
+        return row or (0, 0.0)
+
+    def _transaction(self, update):
+        # BEGIN IMMEDIATE takes the write lock, so the read and the write are atomic across processes
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = update(*self._state())
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def check(self):
+        """Raises CircuitOpenError if calls are currently not allowed."""
+        def claim(failures, opened_until):
+            now = time.time()
+            if opened_until > now:
+                return opened_until - now
+            if failures >= self.failure_threshold:
+                # Cooldown over: this caller makes the trial call, the others keep failing meanwhile
+                self.conn.execute(
+                    "UPDATE circuit_breakers SET opened_until = ? WHERE key = ?", (now + self.trial_timeout, self.key)
+                )
+                logging.getLogger(__name__).info("IBKR circuit breaker half-open, sending a trial query")
+            return 0
+
+        remaining = self._transaction(claim)
+        if remaining > 0:
+            raise CircuitOpenError(f"IBKR circuit breaker open, retrying in {remaining:.0f}s")
+
+    def record_success(self):
+        self.conn.execute("DELETE FROM circuit_breakers WHERE key = ?", (self.key,))
+
+    def record_failure(self):
+        def increment(failures, _):
+            failures += 1
+            opened_until = time.time() + self.cooldown if failures >= self.failure_threshold else 0.0
+            self.conn.execute(
+                "INSERT OR REPLACE INTO circuit_breakers (key, failures, opened_until) VALUES (?, ?, ?)",
+                (self.key, failures, opened_until),
+            )
+            return failures, opened_until
+
+        failures, opened_until = self._transaction(increment)
+        if opened_until:
+            logging.getLogger(__name__).warning(
+                f"IBKR circuit breaker opened after {failures} consecutive failures for {self.cooldown:.0f}s"
+            )
+
+
+class LatencyTracker:
+    """
+    Recent response times per endpoint, used to decide when a request is
+    slow enough to be hedged.
+
+    Args:
+        window (int): Number of recent samples considered.
+        db_path (str): SQLite file shared by the processes.
+    """
+
+    def __init__(self, window: int = 200, db_path: str = None):
+        self.window = window
+        self.conn = _connect(db_path)
+
+    def record(self, endpoint: str, seconds: float):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO latencies (endpoint, seconds, recorded_at) VALUES (?, ?, ?)",
+                (endpoint, seconds, time.time()),
+            )
+            # Keep only the window of recent samples
+            self.conn.execute(
+                "DELETE FROM latencies WHERE endpoint = ? AND rowid NOT IN "
+                "(SELECT rowid FROM latencies WHERE endpoint = ? ORDER BY recorded_at DESC LIMIT ?)",
+                (endpoint, endpoint, self.window),
+            )
+
+    def percentile(self, endpoint: str, percentile: float, min_samples: int = 20) -> Optional[float]:
+        """
+        Returns the given percentile of the recent latencies, or None if
+        there are fewer than `min_samples` samples.
+        """
+        samples = [row[0] for row in self.conn.execute(
+            "SELECT seconds FROM latencies WHERE endpoint = ? ORDER BY seconds", (endpoint,)
+        )]
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(percentile / 100 * len(samples)))]
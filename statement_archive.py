@@ -0,0 +1,72 @@
+import logging
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+DEFAULT_ARCHIVE_DIR = os.path.join("data", "statements")
+_SAVED_AT_FORMAT = "%Y%m%dT%H%M%S%f"
+
+
+class StatementArchive:
+    """
+    Raw Flex statements as downloaded from IBKR, one XML file per run.
+    They are the fallback when IBKR is unavailable and the input to rebuild
+    derived data after a parsing change.
+
+    Args:
+        directory (str): Archive directory; created if needed.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.getenv("IBKR_STATEMENT_DIR", DEFAULT_ARCHIVE_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _prefix(query_id: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_-]", "_", str(query_id))
+
+    def save(self, query_id: str, xml_data: str) -> str:
+        """
+        Stores a statement atomically, so a crash never leaves a truncated
+        file that could be used as fallback.
+
+        Returns:
+            str: Path of the archived statement.
+        """
+        saved_at = datetime.now().strftime(_SAVED_AT_FORMAT)
+        path = os.path.join(self.directory, f"{self._prefix(query_id)}_{saved_at}.xml")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(xml_data)
+        os.replace(tmp_path, path)
+        logging.getLogger(__name__).info(f"Statement archived to {path}")
+        return path
+
+    def _statements(self, query_id: str = None) -> List[Tuple[str, datetime]]:
+        """
+        Returns the archived statements and when they were saved, oldest first.
+        Only names written by `save` match, so stray files and the statements
+        of other queries sharing the prefix (e.g. "123_4" for "123") are skipped.
+        """
+        prefix = re.escape(self._prefix(query_id)) if query_id is not None else ".+"
+        pattern = re.compile(rf"{prefix}_(\d{{8}}T\d{{12}})\.xml")
+        statements = []
+        for name in sorted(os.listdir(self.directory)):
+            match = pattern.fullmatch(name)
+            if match:
+                saved_at = datetime.strptime(match.group(1), _SAVED_AT_FORMAT)
+                statements.append((os.path.join(self.directory, name), saved_at))
+        return statements
+
+    def paths(self, query_id: str = None) -> List[str]:
+        """Returns the archived statements, oldest first."""
+        return [path for path, _ in self._statements(query_id)]
+
+    def latest(self, query_id: str) -> Optional[Tuple[str, datetime]]:
+        """
+        Returns the most recent statement of a query and when it was saved,
+        or None if there is none.
+        """
+        statements = self._statements(query_id)
+        return statements[-1] if statements else None
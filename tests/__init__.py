@@ -1 +1,12 @@
-# Tests package
\ No newline at end of file
+# Tests package
+
+
+def make_dividend(ticker="AAPL", pay_date="2025-07-15", gross=10.0, tax=-1.5, net=None, fx_rate=0.92,
+                  currency="USD", ex_date="", account_id=""):
+    """Builds a dividend record like the ones returned by `get_all_dividends`."""
+    return {
+        "ticker": ticker, "fecha": pay_date, "dividendo_bruto": gross, "tax": tax,
+        "currency": currency, "fxRateToBase": fx_rate, "description": f"{ticker} INC",
+        "exDate": ex_date, "payDate": pay_date.replace("-", ""), "fee": 0,
+        "netAmount": gross + tax if net is None else net, "accountId": account_id
+    }
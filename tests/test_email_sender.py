@@ -196,4 +196,14 @@ class TestCreateHtmlContent:
         result = _create_html_content(one_dividend, date_str)
         text = BeautifulSoup(result, "html.parser").get_text()
 
-        assert "1 dividends received" in text
\ No newline at end of file
+        assert "1 dividends received" in text
+
+    def test_create_html_content_stale_banner(self):
+        """Checks that dividends from a cached statement are flagged as possibly out of date."""
+        stale_dividends = [dict(d, stale=True, statementDate="2025-07-14 10:00") for d in self.sample_dividends]
+
+        stale_text = BeautifulSoup(_create_html_content(stale_dividends, self.dates_str), "html.parser").get_text()
+        fresh_text = BeautifulSoup(_create_html_content(self.sample_dividends, self.dates_str), "html.parser").get_text()
+
+        assert "cached statement from 2025-07-14 10:00" in stale_text
+        assert "cached statement" not in fresh_text
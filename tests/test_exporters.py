@@ -0,0 +1,85 @@
+# tests/test_exporters.py
+
+import pytest
+import csv
+import io
+import json
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+from exporters import EXPORT_FIELDS, export_dividends
+from ibkr_client import iter_dividends
+from load_test import build_statement
+
+
+class TestExportDividends:
+    """Tests for the streaming JSON Lines / CSV / Parquet exporters."""
+
+    def setup_method(self):
+        self.statement = build_statement("U1234567", 5)
+
+    def test_export_jsonl(self):
+        """Checks that each record is one JSON line with the stable schema."""
+        stream = io.StringIO()
+
+        assert export_dividends(iter_dividends(self.statement), "jsonl", stream) == 5
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 5
+        record = json.loads(lines[0])
+        assert list(record) == EXPORT_FIELDS
+        assert record["ticker"] == "T0000"
+        assert record["dividendo_bruto"] == 10.0
+
+    def test_export_csv(self):
+        """Checks the CSV header and that numeric fields are written consistently."""
+        stream = io.StringIO()
+
+        export_dividends(iter_dividends(self.statement), "csv", stream, batch_size=2)
+
+        rows = list(csv.DictReader(io.StringIO(stream.getvalue())))
+        assert len(rows) == 5
+        assert list(rows[0]) == EXPORT_FIELDS
+        # CashTransaction records have no tax: exported as 0.0, not 0
+        assert rows[3]["tax"] == "0.0"
+
+    def test_export_parquet_row_groups(self):
+        """Checks that Parquet batches become row groups with the stable schema."""
+        pq = pytest.importorskip("pyarrow.parquet")
+        stream = io.BytesIO()
+
+        export_dividends(iter_dividends(self.statement), "parquet", stream, batch_size=2)
+
+        parquet_file = pq.ParquetFile(io.BytesIO(stream.getvalue()))
+        assert parquet_file.metadata.num_rows == 5
+        assert parquet_file.metadata.num_row_groups == 3
+        assert parquet_file.schema_arrow.names == EXPORT_FIELDS
+
+    def test_unknown_format_raises(self):
+        """Checks that an unknown export format raises a ValueError."""
+        with pytest.raises(ValueError, match="Unknown export format"):
+            export_dividends([], "xml", io.StringIO())
+
+
+class TestIterDividends:
+    """Tests for the streaming statement parser."""
+
+    def test_processed_elements_are_released(self):
+        """Checks that records are yielded lazily and each parsed element is detached from its parent."""
+        elements = []
+        iterparse = ET.iterparse
+
+        def recording_iterparse(source, events):
+            for event, elem in iterparse(source, events=events):
+                elements.append(elem)
+                yield event, elem
+
+        with patch('ibkr_client.ET.iterparse', recording_iterparse):
+            records = iter_dividends(build_statement("U1234567", 4))
+            assert next(records)["ticker"] == "T0000"
+            accruals = next(e for e in elements if e.tag == "ChangeInDividendAccruals")
+            first = next(e for e in elements if e.tag == "ChangeInDividendAccrual")
+            assert first not in list(accruals)
+
+            assert len(list(records)) == 3
+        assert len(elements[0]) == 0
@@ -0,0 +1,99 @@
+# tests/test_forecast.py
+
+import sqlite3
+
+from dividend_store import DividendStore
+from forecast import detect_frequency, update_calendar, upcoming_dividends
+from email_sender import _create_html_content
+from tests import make_dividend
+
+
+class TestDetectFrequency:
+    """Tests for the payment frequency detection."""
+
+    def test_detect_frequency(self):
+        """Tests the frequency detected from the median gap between payments."""
+        assert detect_frequency(["2025-01-15", "2025-02-14", "2025-03-15"])[0] == "monthly"
+        assert detect_frequency(["2024-10-15", "2025-01-15", "2025-04-15"])[0] == "quarterly"
+        assert detect_frequency(["2024-06-01", "2024-12-01"])[0] == "semiannual"
+        assert detect_frequency(["2023-05-10", "2024-05-10"])[0] == "annual"
+
+    def test_single_payment_is_unknown(self):
+        """Checks that a single payment has no known frequency."""
+        assert detect_frequency(["2025-01-15"]) == ("unknown", 0, 0)
+
+
+class TestDividendCalendar:
+    """Tests for the incremental calendar built from the stored history."""
+
+    def setup_method(self):
+        self.store = DividendStore(":memory:")
+
+    def teardown_method(self):
+        self.store.close()
+
+    def test_add_dividends_ignores_duplicates(self):
+        """Checks that only tickers with new records are reported as changed."""
+        assert self.store.add_dividends([make_dividend("O", "2025-06-13")]) == {"O"}
+        assert self.store.add_dividends([make_dividend("O", "2025-06-13")]) == set()
+
+    def test_same_payment_in_two_accounts_is_kept_twice(self):
+        """Checks that the account is part of the key, so accounts with the same payment are not merged."""
+        payments = [make_dividend("O", "2025-06-13", account_id=account) for account in ("U1", "U2")]
+        self.store.add_dividends(payments)
+        assert self.store.bulk_add_dividends(payments) == 0
+        assert self.store.conn.execute("SELECT COUNT(*) FROM dividends").fetchone()[0] == 2
+
+    def test_history_without_accounts_is_migrated(self, tmp_path):
+        """Tests that a history created before the account column keeps its records."""
+        db_path = str(tmp_path / "dividends.db")
+        conn = sqlite3.connect(db_path)
+        conn.executescript(
+            "CREATE TABLE dividends (ticker TEXT NOT NULL, fecha TEXT NOT NULL, ex_date TEXT NOT NULL, "
+            "pay_date TEXT NOT NULL, currency TEXT NOT NULL, gross REAL NOT NULL, tax REAL NOT NULL, "
+            "fee REAL NOT NULL, net REAL NOT NULL, fx_rate REAL NOT NULL, description TEXT NOT NULL, "
+            "UNIQUE (ticker, fecha, ex_date, pay_date, currency, gross, description));"
+            "INSERT INTO dividends VALUES ('O', '2025-06-13', '', '2025-06-13', 'USD', 10, -1.5, 0, 8.5, 0.92, 'O INC');"
+        )
+        conn.close()
+
+        with DividendStore(db_path) as store:
+            assert store.tickers() == ["O"]
+            assert store.add_dividends([make_dividend("O", "2025-06-13", account_id="U1")]) == {"O"}
+            accounts = store.conn.execute("SELECT account_id FROM dividends ORDER BY account_id").fetchall()
+            assert [row[0] for row in accounts] == ["", "U1"]
+
+    def test_calendar_predicts_next_payment(self):
+        """Checks the next expected ex/pay dates of a quarterly payer."""
+        history = [
+            make_dividend("ARE", "2025-01-15", 33.0, ex_date="20241231"),
+            make_dividend("ARE", "2025-04-15", 33.0, ex_date="20250331"),
+            make_dividend("ARE", "2025-07-15", 34.0, ex_date="20250630"),
+        ]
+        update_calendar(self.store, self.store.add_dividends(history))
+
+        upcoming = upcoming_dividends(self.store, 30, today="2025-10-01")
+
+        assert len(upcoming) == 1
+        assert upcoming[0]["ticker"] == "ARE"
+        assert upcoming[0]["frequency"] == "quarterly"
+        assert upcoming[0]["next_pay_date"] == "2025-10-15"
+        assert upcoming[0]["next_ex_date"] == "2025-09-30"
+        assert upcoming[0]["last_amount"] == 34.0
+
+    def test_upcoming_window(self):
+        """Checks that payments outside the window are not returned."""
+        history = [make_dividend("O", d) for d in ("2025-05-15", "2025-06-13", "2025-07-15")]
+        update_calendar(self.store, self.store.add_dividends(history))
+
+        assert upcoming_dividends(self.store, 30, today="2025-07-20")[0]["next_pay_date"] == "2025-08-15"
+        assert upcoming_dividends(self.store, 10, today="2025-07-20") == []
+
+    def test_calendar_section_in_email(self):
+        """Checks that the optional section is rendered only when there are upcoming payments."""
+        history = [make_dividend("O", d) for d in ("2025-05-15", "2025-06-13", "2025-07-15")]
+        update_calendar(self.store, self.store.add_dividends(history))
+        upcoming = upcoming_dividends(self.store, 30, today="2025-07-20")
+
+        assert "Upcoming Dividends" in _create_html_content(history, "July 2025", upcoming=upcoming)
+        assert "Upcoming Dividends" not in _create_html_content(history, "July 2025")
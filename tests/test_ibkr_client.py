@@ -3,8 +3,16 @@
 import pytest
 from unittest.mock import Mock, patch
 import os
+import requests
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+from datetime import date, timedelta
 
-from ibkr_client import IBKRFlexQuery, get_all_dividends, setup_ibkr_credentials, _get_example_dividends
+from ibkr_client import IBKRFlexQuery, commit_watermarks, get_all_dividends, setup_ibkr_credentials, _get_example_dividends
+from rate_limiter import FlexRateLimiter
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker
+from statement_archive import StatementArchive
+from watermark import FlexWatermarks, completed_through
 
 
 class TestIBKRFlexQuery:
@@ -13,7 +21,12 @@ class TestIBKRFlexQuery:
     def setup_method(self):
         self.token = "test_token_123"
         self.query_id = "test_query_456"
-        self.client = IBKRFlexQuery(self.token)
+        self.rate_limiter = FlexRateLimiter(self.token, requests_per_minute=600, burst=10, db_path=":memory:")
+        self.circuit_breaker = CircuitBreaker(self.token, failure_threshold=2, cooldown=60, db_path=":memory:")
+        self.latency_tracker = LatencyTracker(db_path=":memory:")
+        self.client = IBKRFlexQuery(self.token, rate_limiter=self.rate_limiter,
+                                    circuit_breaker=self.circuit_breaker,
+                                    latency_tracker=self.latency_tracker)
     
     @patch('ibkr_client.requests.get')
     def test_request_query_execution_success(self, mock_get):
@@ -57,9 +70,49 @@ class TestIBKRFlexQuery:
         assert mock_get.call_count == 2
         mock_sleep.assert_called_once()
 
+    @patch('ibkr_client.requests.get')
+    def test_throttled_request_backs_off_and_retries(self, mock_get):
+        """Tests that a 1018 response backs off the shared budget and does not consume a poll attempt."""
+        response_throttled = Mock()
+        response_throttled.status_code = 200
+        response_throttled.text = "<FlexStatementResponse><Status>Warn</Status><ErrorCode>1018</ErrorCode><ErrorMessage>Too many requests have been made from this token. Please try again shortly.</ErrorMessage></FlexStatementResponse>"
+
+        response_success = Mock()
+        response_success.status_code = 200
+        response_success.text = "<FlexQueryResponse>...</FlexQueryResponse>"
+
+        mock_get.side_effect = [response_throttled, response_success]
+
+        with patch.object(self.rate_limiter, 'penalize') as mock_penalize:
+            result = self.client._get_query_results("ref_code_123", "3", max_attempts=1)
+
+        assert result == response_success.text
+        mock_penalize.assert_called_once_with(0)
+
+    @patch('ibkr_client.requests.get')
+    def test_persistent_throttling_raises(self, mock_get):
+        """Tests that the client gives up after max_throttle_retries throttling responses."""
+        response_throttled = Mock()
+        response_throttled.status_code = 429
+        mock_get.return_value = response_throttled
+        self.client.max_throttle_retries = 2
+
+        with patch.object(self.rate_limiter, 'penalize'):
+            with pytest.raises(Exception, match="too many requests"):
+                self.client._request_query_execution(self.query_id, "3")
+
+        assert mock_get.call_count == 3
+
 
 class TestGetAllDividends:
     """Tests for the main get_all_dividends function."""
+
+    @pytest.fixture(autouse=True)
+    def statement_dir(self, tmp_path, monkeypatch):
+        """Archives statements and watermarks in a temporary directory."""
+        monkeypatch.setenv('IBKR_STATEMENT_DIR', str(tmp_path))
+        monkeypatch.setenv('IBKR_WATERMARK_DB', str(tmp_path / 'watermarks.db'))
+        return tmp_path
     
     @patch.dict(os.environ, {
         'IBKR_FLEX_TOKEN': 'test_token',
@@ -107,9 +160,15 @@ class TestGetAllDividends:
         assert msft_div['fecha'] == "2025-07-16"
     
     @patch.dict(os.environ, {}, clear=True)
+    def test_get_all_dividends_no_credentials_fails(self):
+        """Checks that missing credentials fail the run instead of returning the example dividends."""
+        with pytest.raises(Exception, match="not configured"):
+            get_all_dividends()
+
+    @patch.dict(os.environ, {'IBKR_USE_EXAMPLE_DATA': 'true'}, clear=True)
     @patch('ibkr_client._get_example_dividends')
     def test_get_all_dividends_no_credentials_fallback(self, mock_example):
-        """Tests that example data is used if there are no credentials."""
+        """Tests that example data is used without credentials only when explicitly enabled."""
         mock_example.return_value = [{'ticker': 'TEST_EXAMPLE', 'dividendo_bruto': 100.0}]
         
         with patch('ibkr_client.logging.getLogger') as mock_logger:
@@ -129,19 +188,297 @@ class TestGetAllDividends:
     })
     @patch('ibkr_client.IBKRFlexQuery')
     @patch('ibkr_client._get_example_dividends')
-    def test_get_all_dividends_api_error_fallback(self, mock_example, mock_client_class):
-        """Tests the fallback to example data if the API call fails."""
+    def test_get_all_dividends_api_error_uses_cached_statement(self, mock_example, mock_client_class):
+        """Tests that an API error falls back to the last real statement, marked as stale, never to example data."""
         mock_client = Mock()
         mock_client_class.return_value = mock_client
+        StatementArchive().save('test_query', """<FlexQueryResponse><FlexStatements><FlexStatement>
+            <ChangeInDividendAccruals>
+                <ChangeInDividendAccrual symbol="AAPL" date="20250715" grossAmount="50.0" netAmount="42.5" tax="-7.5" currency="USD" fxRateToBase="0.92" description="APPLE DIV" />
+            </ChangeInDividendAccruals>
+        </FlexStatement></FlexStatements></FlexQueryResponse>""")
         mock_client.execute_query.side_effect = Exception("API Error")
         
-        mock_example.return_value = [{'ticker': 'FALLBACK_EXAMPLE', 'dividendo_bruto': 50.0}]
-        
         result = get_all_dividends()
         
-        mock_example.assert_called_once_with()
+        mock_example.assert_not_called()
         assert len(result) == 1
-        assert result[0]['ticker'] == 'FALLBACK_EXAMPLE'
+        assert result[0]['ticker'] == 'AAPL'
+        assert result[0]['stale'] is True
+        assert result[0]['statementDate']
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_api_error_without_cache_raises(self, mock_client_class):
+        """Tests that an API error with no cached statement fails loudly."""
+        mock_client_class.return_value.execute_query.side_effect = Exception("API Error")
+
+        with pytest.raises(Exception, match="no cached statement"):
+            get_all_dividends()
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query',
+        'IBKR_FAILURE_POLICY': 'fail'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_fail_policy_raises(self, mock_client_class):
+        """Tests that the 'fail' policy raises even if a cached statement exists."""
+        StatementArchive().save('test_query', "<FlexQueryResponse />")
+        mock_client_class.return_value.execute_query.side_effect = Exception("API Error")
+
+        with pytest.raises(Exception, match="IBKR_FAILURE_POLICY is 'fail'"):
+            get_all_dividends()
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_archives_statement(self, mock_client_class, statement_dir):
+        """Tests that successfully parsed statements are archived for later fallbacks."""
+        mock_client_class.return_value.execute_query.return_value = "<FlexQueryResponse />"
+
+        assert get_all_dividends() == []
+        assert len(StatementArchive().paths('test_query')) == 1
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_requests_delta_after_watermark(self, mock_client_class):
+        """Tests that the first run uses the configured period and the next one only the days after it."""
+        execute_query = mock_client_class.return_value.execute_query
+        execute_query.return_value = (
+            '<FlexQueryResponse><FlexStatements><FlexStatement toDate="20250715" whenGenerated="20250716;080000" />'
+            '</FlexStatements></FlexQueryResponse>'
+        )
+
+        get_all_dividends()
+        assert execute_query.call_args.kwargs == {'from_date': None, 'to_date': None}
+        assert FlexWatermarks().get('test_query') == date(2025, 7, 15)
+
+        get_all_dividends()
+        assert execute_query.call_args.kwargs == {
+            'from_date': date(2025, 7, 16), 'to_date': date.today() - timedelta(days=1)
+        }
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_returns_pending_watermark(self, mock_client_class):
+        """Tests that the watermark is only returned, not saved, when the caller commits it after delivery."""
+        mock_client_class.return_value.execute_query.return_value = (
+            '<FlexQueryResponse><FlexStatements><FlexStatement toDate="20250715" whenGenerated="20250716;080000" />'
+            '</FlexStatements></FlexQueryResponse>'
+        )
+        pending = []
+
+        get_all_dividends(pending_watermarks=pending)
+        assert pending == [('test_query', date(2025, 7, 15), '20250716;080000')]
+        assert FlexWatermarks().get('test_query') is None
+
+        commit_watermarks(pending)
+        assert FlexWatermarks().get('test_query') == date(2025, 7, 15)
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_skips_request_when_up_to_date(self, mock_client_class):
+        """Tests that no statement is requested when every complete day, up to yesterday, was processed."""
+        with FlexWatermarks() as watermarks:
+            watermarks.advance('test_query', date.today() - timedelta(days=1))
+
+        assert get_all_dividends() == []
+        mock_client_class.return_value.execute_query.assert_not_called()
+
+    @patch.dict(os.environ, {
+        'IBKR_FLEX_TOKEN': 'test_token',
+        'IBKR_DIVIDENDS_QUERY_ID': 'test_query',
+        'IBKR_DELTA_FETCH': 'false'
+    })
+    @patch('ibkr_client.IBKRFlexQuery')
+    def test_get_all_dividends_delta_fetch_disabled(self, mock_client_class):
+        """Tests that IBKR_DELTA_FETCH=false always requests the configured period."""
+        with FlexWatermarks() as watermarks:
+            watermarks.advance('test_query', date(2025, 7, 15))
+        execute_query = mock_client_class.return_value.execute_query
+        execute_query.return_value = "<FlexQueryResponse />"
+
+        get_all_dividends()
+        assert execute_query.call_args.kwargs == {'from_date': None, 'to_date': None}
+
+
+class TestWatermark:
+    """Tests for the per-query watermarks and the Flex date override."""
+
+    def test_completed_through_excludes_day_generated_on(self):
+        """Tests that a day is only complete if the statement was generated after it."""
+        assert completed_through([{"toDate": "20250715", "whenGenerated": "20250716;080000"}]) == date(2025, 7, 15)
+        assert completed_through([{"toDate": "20250715", "whenGenerated": "20250715;120000"}]) == date(2025, 7, 14)
+        assert completed_through([{"toDate": "20250715"}, {"toDate": "20250710"}]) == date(2025, 7, 10)
+        assert completed_through([{}]) is None
+
+    def test_watermark_never_moves_back(self):
+        """Checks that an older period never moves the watermark back and the window ends yesterday."""
+        with FlexWatermarks(":memory:") as watermarks:
+            watermarks.advance("q", date(2025, 7, 15))
+            watermarks.advance("q", date(2025, 7, 1))
+            assert watermarks.get("q") == date(2025, 7, 15)
+            assert watermarks.delta_window("q", date(2025, 7, 20)) == (date(2025, 7, 16), date(2025, 7, 19))
+            assert watermarks.delta_window("q", date(2025, 7, 16)) == (date(2025, 7, 16), date(2025, 7, 15))
+            assert watermarks.delta_window("other") is None
+
+    @patch('ibkr_client.requests.get')
+    def test_date_override_parameters(self, mock_get):
+        """Tests that the delta window is sent as the fd and td overrides."""
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.text = "<FlexStatementResponse><ReferenceCode>1</ReferenceCode></FlexStatementResponse>"
+        client = IBKRFlexQuery("t", rate_limiter=FlexRateLimiter("t", db_path=":memory:"),
+                               circuit_breaker=CircuitBreaker("t", db_path=":memory:"),
+                               latency_tracker=LatencyTracker(db_path=":memory:"))
+
+        client._request_query_execution("q", "3", date(2025, 7, 16), date(2025, 7, 20))
+        params = mock_get.call_args.kwargs["params"]
+        assert params["fd"] == "20250716"
+        assert params["td"] == "20250720"
+
+
+class TestResilience:
+    """Tests for the circuit breaker and hedged GetStatement polls."""
+
+    def setup_method(self):
+        self.token = "test_token_123"
+        self.circuit_breaker = CircuitBreaker(self.token, failure_threshold=2, cooldown=60, db_path=":memory:")
+        self.latency_tracker = LatencyTracker(db_path=":memory:")
+        self.client = IBKRFlexQuery(
+            self.token,
+            rate_limiter=FlexRateLimiter(self.token, requests_per_minute=600, burst=10, db_path=":memory:"),
+            circuit_breaker=self.circuit_breaker,
+            latency_tracker=self.latency_tracker,
+        )
+
+    @patch('ibkr_client.requests.get')
+    def test_circuit_opens_after_repeated_failures(self, mock_get):
+        """Tests that once the circuit is open, calls fail without contacting IBKR."""
+        mock_get.side_effect = requests.exceptions.ConnectionError("down")
+
+        for _ in range(2):
+            with pytest.raises(Exception, match="Request error"):
+                self.client.execute_query("query")
+        calls = mock_get.call_count
+
+        with pytest.raises(CircuitOpenError):
+            self.client.execute_query("query")
+        assert mock_get.call_count == calls
+
+    @patch('ibkr_client.requests.get')
+    def test_success_closes_circuit(self, mock_get):
+        """Tests that a successful query resets the failure count."""
+        self.circuit_breaker.record_failure()
+        ok_reference = Mock(status_code=200, text="<FlexStatementResponse><ReferenceCode>1</ReferenceCode></FlexStatementResponse>")
+        ok_statement = Mock(status_code=200, text="<FlexQueryResponse />")
+        mock_get.side_effect = [ok_reference, ok_statement]
+
+        self.client.execute_query("query")
+
+        assert self.circuit_breaker._state() == (0, 0.0)
+
+    def test_only_one_trial_call_after_cooldown(self, tmp_path):
+        """Tests that after the cooldown a single caller across processes gets the trial call."""
+        db_path = str(tmp_path / "resilience.db")
+        first = CircuitBreaker(self.token, failure_threshold=2, cooldown=0.05, db_path=db_path)
+        second = CircuitBreaker(self.token, failure_threshold=2, cooldown=0.05, db_path=db_path)
+        first.record_failure()
+        second.record_failure()
+        assert first._state()[0] == 2
+        with pytest.raises(CircuitOpenError):
+            second.check()
+
+        time.sleep(0.1)
+        first.check()
+        with pytest.raises(CircuitOpenError):
+            second.check()
+
+        first.record_success()
+        second.check()
+
+    @patch('ibkr_client.requests.get')
+    def test_slow_poll_is_hedged(self, mock_get):
+        """Tests that a GetStatement slower than the recorded p95 sends a duplicate and uses the first answer."""
+        for _ in range(20):
+            self.latency_tracker.record("FlexStatementService.GetStatement", 0.05)
+
+        slow = Mock(status_code=200, text="<FlexQueryResponse>slow</FlexQueryResponse>")
+        fast = Mock(status_code=200, text="<FlexQueryResponse>fast</FlexQueryResponse>")
+        def answer(url, params, timeout):
+            if mock_get.call_count == 1:
+                time.sleep(0.5)
+                return slow
+            return fast
+        mock_get.side_effect = answer
+
+        result = self.client._get_query_results("ref_code_123", "3")
+
+        assert result == fast.text
+        assert mock_get.call_count == 2
+
+    @patch('ibkr_client.requests.get')
+    def test_slow_poll_not_hedged_without_budget(self, mock_get):
+        """Tests that no duplicate is sent when the request budget has no slot available right away."""
+        for _ in range(20):
+            self.latency_tracker.record("FlexStatementService.GetStatement", 0.05)
+
+        def answer(url, params, timeout):
+            time.sleep(0.3)
+            return Mock(status_code=200, text="<FlexQueryResponse>slow</FlexQueryResponse>")
+        mock_get.side_effect = answer
+
+        with patch.object(self.client.rate_limiter, 'try_acquire', return_value=False):
+            result = self.client._get_query_results("ref_code_123", "3")
+
+        assert "slow" in result
+        assert mock_get.call_count == 1
+
+    @patch('ibkr_client.requests.get')
+    def test_hedge_success_used_when_both_finish_together(self, mock_get):
+        """Tests that a failed request does not hide the other one when both finish at the same time."""
+        for _ in range(20):
+            self.latency_tracker.record("FlexStatementService.GetStatement", 0.05)
+
+        def answer(url, params, timeout):
+            if mock_get.call_count == 1:
+                time.sleep(0.2)
+                raise requests.exceptions.ConnectionError("reset")
+            return Mock(status_code=200, text="<FlexQueryResponse>hedge</FlexQueryResponse>")
+        mock_get.side_effect = answer
+
+        def wait_both(futures, timeout=None, return_when=ALL_COMPLETED):
+            # The race between both requests reports them as done, as if they had finished together
+            return wait(futures, None if return_when == FIRST_COMPLETED else timeout)
+
+        with patch('ibkr_client.wait', side_effect=wait_both):
+            response = self.client._get_hedged("url", {})
+
+        assert "hedge" in response.text
+
+    @patch('ibkr_client.requests.get')
+    def test_latency_excludes_budget_wait(self, mock_get):
+        """Tests that the recorded latency is the HTTP round trip, not the time waiting for the budget."""
+        mock_get.return_value = Mock(status_code=200, text="<FlexQueryResponse />")
+
+        with patch.object(self.client.rate_limiter, 'acquire', side_effect=lambda: time.sleep(0.3)):
+            self.client._get_hedged("url", {})
+
+        assert self.latency_tracker.percentile("FlexStatementService.GetStatement", 50, min_samples=1) < 0.1
 
 
 class TestGetExampleDividends:
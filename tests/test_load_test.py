@@ -0,0 +1,94 @@
+# tests/test_load_test.py
+
+import pytest
+import os
+from unittest.mock import patch
+
+from ibkr_client import IBKRFlexQuery, parse_dividends
+from email_sender import send_dividend_email
+from rate_limiter import FlexRateLimiter
+from resilience import CircuitBreaker, LatencyTracker
+from load_test import FakeFlexServer, SMTPSink, build_statement, run_load_test
+
+
+def _client(server, **kwargs):
+    return IBKRFlexQuery(
+        "token", base_url=server.base_url,
+        rate_limiter=FlexRateLimiter("token", requests_per_minute=6000, burst=10, db_path=":memory:"),
+        circuit_breaker=CircuitBreaker("token", db_path=":memory:"),
+        latency_tracker=LatencyTracker(db_path=":memory:"),
+        **kwargs
+    )
+
+
+class TestFakeFlexServer:
+    """Tests for the local Flex Web Service stand-in."""
+
+    def test_client_fetches_statement_after_generation_delay(self):
+        """Checks that the real client polls through 'in progress' and parses the statement."""
+        with FakeFlexServer(generation_delay=0.05, statement_rows=6) as server:
+            client = _client(server, poll_interval=0.01)
+            dividends = parse_dividends(client.execute_query("query"))
+
+            assert len(dividends) == 6
+            assert server.stats["send_request"] == 1
+            assert server.stats["get_statement"] >= 2
+
+    def test_throttling_returns_error_1018(self):
+        """Checks that requests above the per-token budget are rejected."""
+        server = FakeFlexServer(throttle_per_second=1)
+
+        assert "<ReferenceCode>" in server.handle("FlexStatementService.SendRequest", {"t": "a"})
+        assert "<ErrorCode>1018</ErrorCode>" in server.handle("FlexStatementService.SendRequest", {"t": "a"})
+        # Other tokens have their own budget
+        assert "<ReferenceCode>" in server.handle("FlexStatementService.SendRequest", {"t": "b"})
+        server.stop()
+
+    def test_injected_errors_surface_in_client(self):
+        """Checks that configured error codes reach the client as IBKR errors."""
+        with FakeFlexServer(error_rate=1.0, error_code="1009") as server:
+            client = _client(server)
+            with pytest.raises(Exception, match="Error in IBKR: The server is under heavy load"):
+                client.execute_query("query")
+
+    def test_build_statement_size(self):
+        """Checks that the statement contains the requested number of dividend rows."""
+        assert len(parse_dividends(build_statement("U1234567", 25))) == 25
+
+
+class TestSMTPSink:
+    """Tests for the local SMTP sink."""
+
+    def test_send_dividend_email_reaches_sink(self):
+        """Checks that send_dividend_email delivers to the sink without STARTTLS."""
+        dividends = parse_dividends(build_statement("U1234567", 2))
+        with SMTPSink() as sink:
+            with patch.dict(os.environ, {
+                'SMTP_SERVER': sink.host,
+                'SMTP_PORT': str(sink.port),
+                'SMTP_USE_TLS': 'false',
+                'SENDER_EMAIL': 'sender@test.com',
+                'RECIPIENT_EMAIL': 'recipient@test.com',
+                'SMTP_USERNAME': 'user_test',
+                'SMTP_PASSWORD': 'password123'
+            }):
+                send_dividend_email(dividends, "2025-07-15")
+
+            assert sink.messages == 1
+            assert sink.bytes_received > 0
+
+
+class TestRunLoadTest:
+    """Tests for the load test driver."""
+
+    def test_run_load_test_reports_throughput_and_latency(self):
+        """Checks that every simulated account is processed and reported."""
+        results = run_load_test(accounts=5, concurrency=2, generation_delay=0.0,
+                                statement_rows=4, poll_interval=0.01)
+
+        assert results["succeeded"] == 5
+        assert results["failed"] == 0
+        assert results["emails_received"] == 5
+        assert results["throughput"] > 0
+        assert results["total"]["p99"] >= results["total"]["p50"]
+        assert 'SMTP_USE_TLS' not in os.environ
@@ -0,0 +1,79 @@
+# tests/test_main.py
+
+import os
+import subprocess
+import sys
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+import main
+
+PENDING = ("test_query", date(2025, 7, 15), "20250716;080000")
+
+
+def _get_all_dividends(dividends):
+    """Stands in for get_all_dividends, returning a pending watermark like a delta fetch."""
+    def fake(positions=None, pending_watermarks=None):
+        pending_watermarks.append(PENDING)
+        return dividends
+    return fake
+
+
+class TestMain:
+    """Tests for the watermark handling of a run."""
+
+    @pytest.fixture(autouse=True)
+    def quiet_run(self):
+        """Skips the logger setup, the dividend calendar and the sink configuration."""
+        with patch('main.setup_logger'), \
+             patch('main.update_dividend_calendar', return_value=([], {})), \
+             patch('main.configured_sinks', return_value=[]):
+            yield
+
+    @patch('main.commit_watermarks')
+    @patch('main.dispatch_notifications', return_value={"email": False, "telegram": True})
+    def test_watermark_committed_after_a_delivery(self, mock_dispatch, mock_commit):
+        """Tests that the watermark is saved when at least one sink delivered the report."""
+        with patch('main.get_all_dividends', _get_all_dividends([{"ticker": "AAPL"}])), \
+             patch('main.build_report'):
+            assert main.main() is True
+        mock_commit.assert_called_once_with([PENDING])
+
+    @patch('main.commit_watermarks')
+    @patch('main.dispatch_notifications', return_value={"email": False, "webhook": False})
+    def test_failed_delivery_keeps_watermark_and_fails_run(self, mock_dispatch, mock_commit):
+        """Tests that the same days are requested again and the run fails when every sink failed."""
+        with patch('main.get_all_dividends', _get_all_dividends([{"ticker": "AAPL"}])), \
+             patch('main.build_report'):
+            assert main.main() is False
+        mock_commit.assert_not_called()
+
+    @patch('main.commit_watermarks')
+    @patch('main.dispatch_notifications')
+    def test_empty_statement_commits_watermark(self, mock_dispatch, mock_commit):
+        """Tests that a window without dividends is not requested again."""
+        with patch('main.get_all_dividends', _get_all_dividends([])):
+            assert main.main() is True
+        mock_dispatch.assert_not_called()
+        mock_commit.assert_called_once_with([PENDING])
+
+    @patch.dict('os.environ', {}, clear=True)
+    @patch('main.dispatch_notifications')
+    def test_missing_credentials_fail_run(self, mock_dispatch):
+        """Checks that a run without IBKR credentials fails instead of reporting the example dividends."""
+        assert main.main() is False
+        mock_dispatch.assert_not_called()
+
+
+class TestCommandLine:
+    """Tests for the command-line options."""
+
+    def test_profile_is_rejected_with_subcommands(self):
+        """Checks that --profile is refused with export and reindex instead of being ignored."""
+        for command in ("export", "reindex"):
+            result = subprocess.run([sys.executable, "main.py", "--profile", command], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            assert result.returncode == 2
+            assert "--profile only applies to the daily run" in result.stderr
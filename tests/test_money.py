@@ -0,0 +1,76 @@
+# tests/test_money.py
+
+import numpy as np
+import pytest
+
+from money import CENT, SCALE, DividendAmounts, convert, round_half_even, to_micros
+from email_sender import _aggregate_dividends
+from tests import make_dividend
+
+
+class TestFixedPoint:
+    """Tests for the integer micro-unit arithmetic."""
+
+    def test_to_micros_is_exact(self):
+        """Tests that decimal amounts are converted to exact micro-units."""
+        assert to_micros([0.1, -28.05, 0.86192]).tolist() == [100000, -28050000, 861920]
+
+    def test_to_micros_rejects_inexact_amounts(self):
+        """Checks that amounts beyond the exact float range are rejected."""
+        with pytest.raises(ValueError):
+            to_micros([1e10])
+
+    def test_round_half_even(self):
+        """Tests that ties are rounded to the even neighbour, also for negative amounts."""
+        numerators = np.array([15, 25, 35, -15, -25, 14, 16], dtype=np.int64)
+        assert round_half_even(numerators, 10).tolist() == [2, 2, 4, -2, -2, 1, 2]
+
+    def test_convert_rounds_to_cents(self):
+        """Tests that converted amounts are rounded half-even to whole cents."""
+        # 10.005 USD * 1.0 = 10.005 EUR -> 10.00 (half to even); 10.015 -> 10.02
+        converted = convert(to_micros([10.005, 10.015]), to_micros([1.0, 1.0]))
+        assert converted.tolist() == [10_000_000, 10_020_000]
+        assert (converted % CENT == 0).all()
+
+    def test_convert_falls_back_to_python_ints_on_overflow(self):
+        """Checks that products overflowing int64 are computed with Python integers."""
+        amounts = np.array([9_000_000 * SCALE], dtype=np.int64)
+        rates = to_micros([3.123456])
+        assert convert(amounts, rates).tolist() == [28_111_104_000_000]
+
+
+class TestDividendAmounts:
+    """Tests for the batch conversion of dividend amounts."""
+
+    def test_totals_are_exact_sums_of_rows(self):
+        """Tests that the totals add up exactly, without float drift."""
+        dividends = [make_dividend(gross=0.1, tax=-0.01, net=0.09, fx_rate=1.0)] * 1000
+        amounts = DividendAmounts(dividends)
+        assert amounts.totals() == {"gross": 100 * SCALE, "tax": 10 * SCALE, "net": 90 * SCALE}
+
+    def test_exchange_rates_in_order_of_appearance(self):
+        """Tests that the first rate of each currency is kept, in order of appearance."""
+        dividends = [
+            make_dividend(gross=1, tax=0, net=1, fx_rate=1.17, currency="GBP"),
+            make_dividend(gross=1, tax=0, net=1, fx_rate=0.92, currency="USD"),
+            make_dividend(gross=1, tax=0, net=1, fx_rate=1.18, currency="GBP"),
+            make_dividend(gross=1, tax=0, net=1, fx_rate=1.0, currency=None),
+        ]
+        assert DividendAmounts(dividends).exchange_rates() == {"GBP": 1.17, "USD": 0.92}
+
+    def test_missing_fx_rate_defaults_to_one(self):
+        """Checks that a record without fxRateToBase is taken as already in EUR."""
+        amounts = DividendAmounts([{"dividendo_bruto": 5.0, "tax": 0, "netAmount": 5.0}])
+        assert amounts.totals()["gross"] == 5 * SCALE
+
+    def test_aggregate_matches_rows_shown(self):
+        """Tests that the totals of the email are the sums of the rounded rows shown."""
+        dividends = [
+            make_dividend(gross=33, tax=-4.95, net=-28.05, fx_rate=0.86192),
+            make_dividend(gross=26.9, tax=-4.04, net=-22.86, fx_rate=0.86192),
+        ]
+        summary = _aggregate_dividends(dividends)
+        gross, tax, net = summary["rows_eur"]
+        assert gross == [28.44, 23.19]
+        assert summary["total_gross_eur"] == 51.63
+        assert summary["total_net_eur"] == round(sum(net), 2)
@@ -0,0 +1,178 @@
+# tests/test_notifiers.py
+
+import pytest
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import email_sender
+from load_test import SMTPSink
+from notifiers import (EmailSink, NotificationSink, TelegramSink, WebhookSink, build_report,
+                       configured_sinks, dispatch_notifications)
+
+
+class LocalHTTPStandIn:
+    """Local HTTP server recording JSON POSTs and answering with scripted status codes."""
+
+    def __init__(self, statuses=(200,), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stand_in.requests.append((self.path, json.loads(body)))
+                time.sleep(stand_in.delay)
+                status = stand_in.statuses.pop(0) if len(stand_in.statuses) > 1 else stand_in.statuses[0]
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"ok": true}')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestNotificationSinks:
+    """Tests for the email, Telegram and webhook sinks."""
+
+    def setup_method(self):
+        self.dividends = [
+            {
+                "ticker": "AAPL", "fecha": "2025-07-15", "dividendo_bruto": 50.00, "tax": -7.50,
+                "netAmount": 42.50, "currency": "USD", "fxRateToBase": 0.92, "description": "APPLE INC"
+            },
+            {
+                "ticker": "HSBC", "fecha": "2025-07-16", "dividendo_bruto": 40.00, "tax": -10.00,
+                "netAmount": 30.00, "currency": "GBP", "fxRateToBase": 1.17, "description": "HSBC HOLDINGS PLC"
+            }
+        ]
+        self.report = build_report(self.dividends, "2025-07-16")
+
+    def test_build_report_aggregates_once(self):
+        """Checks the shared totals used by every sink."""
+        assert self.report["summary"]["total_gross_eur"] == pytest.approx(92.80)
+        assert self.report["summary"]["total_net_eur"] == pytest.approx(74.20)
+
+    def test_telegram_sink_posts_send_message(self):
+        """Checks the Bot API method, chat and rendered text."""
+        with LocalHTTPStandIn() as api:
+            sink = TelegramSink("123:ABC", "42", api_url=api.url, timeout=2)
+            assert sink.deliver(self.report) is True
+
+        path, payload = api.requests[0]
+        assert path == "/bot123:ABC/sendMessage"
+        assert payload["chat_id"] == "42"
+        assert payload["parse_mode"] == "HTML"
+        assert "Net: €74.20" in payload["text"]
+        assert "AAPL: 42.50 USD" in payload["text"]
+
+    def test_webhook_sink_retries_server_errors(self):
+        """Checks that a 5xx answer is retried and the JSON report is posted."""
+        with LocalHTTPStandIn(statuses=(500, 200)) as hook:
+            sink = WebhookSink(hook.url + "/dividends", timeout=2, retries=2, backoff=0.01)
+            assert sink.deliver(self.report) is True
+
+        assert len(hook.requests) == 2
+        payload = hook.requests[1][1]
+        assert payload["totals_eur"] == {"gross": 92.8, "tax": 18.6, "net": 74.2}
+        assert [d["ticker"] for d in payload["dividends"]] == ["AAPL", "HSBC"]
+
+    def test_webhook_sink_does_not_retry_client_errors(self):
+        """Checks that 4xx answers fail without retrying."""
+        with LocalHTTPStandIn(statuses=(404,)) as hook:
+            sink = WebhookSink(hook.url, timeout=2, retries=3, backoff=0.01)
+            assert sink.deliver(self.report) is False
+
+        assert len(hook.requests) == 1
+
+    def test_sink_timeout(self):
+        """Checks that each attempt is bounded by the sink timeout."""
+        with LocalHTTPStandIn(delay=1.0) as hook:
+            sink = WebhookSink(hook.url, timeout=0.2, retries=0)
+            started = time.perf_counter()
+            assert sink.deliver(self.report) is False
+            assert time.perf_counter() - started < 0.9
+
+    def test_email_sink_sends_to_smtp(self):
+        """Tests that the email sink delivers the report to the SMTP server."""
+        with SMTPSink() as smtp, patch.dict(os.environ, {
+            'SMTP_SERVER': smtp.host,
+            'SMTP_PORT': str(smtp.port),
+            'SMTP_USE_TLS': 'false',
+            'SENDER_EMAIL': 'sender@test.com',
+            'RECIPIENT_EMAIL': 'recipient@test.com',
+            'SMTP_USERNAME': 'user_test',
+            'SMTP_PASSWORD': 'password123'
+        }):
+            assert EmailSink(timeout=2).deliver(self.report) is True
+            assert smtp.messages == 1
+
+    @patch.dict(os.environ, {'RECIPIENT_EMAIL': 'recipient@test.com'}, clear=True)
+    def test_email_sink_incomplete_config_is_not_retried(self):
+        """Checks that a missing email configuration fails without retries."""
+        with patch('notifiers.send_report_email', wraps=email_sender.send_report_email) as mock_send:
+            assert EmailSink(retries=3, backoff=0.01).deliver(self.report) is False
+            assert mock_send.call_count == 1
+
+
+class TestDispatchNotifications:
+    """Tests for the concurrent dispatch to all configured sinks."""
+
+    def test_slow_sink_does_not_delay_others(self):
+        """Checks that sinks run concurrently and results are reported per sink."""
+        finished = {}
+
+        class RecordingSink(NotificationSink):
+            def __init__(self, name, delay, fail=False):
+                super().__init__(retries=0)
+                self.name = name
+                self.delay = delay
+                self.fail = fail
+
+            def send(self, report):
+                time.sleep(self.delay)
+                finished[self.name] = time.perf_counter()
+                if self.fail:
+                    raise Exception("boom")
+
+        started = time.perf_counter()
+        results = dispatch_notifications(
+            [RecordingSink("slow", 0.5), RecordingSink("fast", 0.0), RecordingSink("broken", 0.0, fail=True)],
+            {"dividends": []},
+        )
+
+        assert results == {"slow": True, "fast": True, "broken": False}
+        assert finished["fast"] - started < 0.25
+        assert time.perf_counter() - started < 0.9
+
+    @patch.dict(os.environ, {
+        'RECIPIENT_EMAIL': 'recipient@test.com',
+        'TELEGRAM_BOT_TOKEN': '123:ABC',
+        'TELEGRAM_CHAT_ID': '42',
+        'WEBHOOK_URL': 'http://127.0.0.1:1/hook',
+        'WEBHOOK_TIMEOUT': '3',
+    }, clear=True)
+    def test_configured_sinks_from_environment(self):
+        """Tests that the sinks and their timeouts are read from the environment."""
+        sinks = configured_sinks()
+
+        assert [s.name for s in sinks] == ["email", "telegram", "webhook"]
+        assert sinks[2].timeout == 3.0
@@ -0,0 +1,99 @@
+# tests/test_positions.py
+
+import pytest
+
+from email_sender import _aggregate_dividends, _create_html_content
+from ibkr_client import iter_dividends
+from positions import PositionIndex
+
+STATEMENT = """<FlexQueryResponse><FlexStatements count="2">
+    <FlexStatement accountId="U1" fromDate="20250701" toDate="20250731" whenGenerated="20250801;080000">
+        <ChangeInDividendAccruals>
+            <ChangeInDividendAccrual conid="265598" symbol="AAPL" currency="USD" fxRateToBase="0.9" date="20250715" exDate="20250711" payDate="20250715" tax="-7.5" fee="0" grossAmount="-50" netAmount="-42.5" description="APPLE INC" />
+            <ChangeInDividendAccrual conid="13905" symbol="O" currency="USD" fxRateToBase="0.9" date="20250715" exDate="20250701" payDate="20250715" tax="-4.04" fee="0" grossAmount="-26.9" netAmount="-22.86" description="REALTY INCOME" />
+        </ChangeInDividendAccruals>
+        <CashTransactions>
+            <CashTransaction conid="265598" symbol="AAPL" dateTime="20250715" amount="50" currency="USD" fxRateToBase="0.9" activityDescription="AAPL Cash Dividend USD 0.25 per Share" />
+        </CashTransactions>
+        <OpenPositions>
+            <OpenPosition accountId="U1" conid="265598" symbol="AAPL" currency="USD" fxRateToBase="0.9" position="200" costBasisMoney="20000" levelOfDetail="SUMMARY" />
+            <OpenPosition accountId="U1" conid="265598" symbol="AAPL" currency="USD" fxRateToBase="0.9" position="100" costBasisMoney="9000" levelOfDetail="LOT" />
+        </OpenPositions>
+    </FlexStatement>
+    <FlexStatement accountId="U2" fromDate="20250701" toDate="20250731" whenGenerated="20250801;080000">
+        <OpenPositions>
+            <OpenPosition conid="13905" symbol="O" currency="USD" fxRateToBase="0.9" position="50" costBasisMoney="2700" />
+        </OpenPositions>
+    </FlexStatement>
+</FlexStatements></FlexQueryResponse>"""
+
+
+class TestPositionIndex:
+    """Tests for the hash index of open positions."""
+
+    def setup_method(self):
+        self.index = PositionIndex()
+        self.index.add({"accountId": "U1", "conid": "1", "symbol": "AAA", "position": "10", "costBasisMoney": "100"})
+        self.index.add({"conid": "2", "symbol": "BBB", "position": "5", "costBasisMoney": "50"}, account_id="U2")
+
+    def test_lookup_by_conid_then_symbol(self):
+        """Tests that positions are found by conid, falling back to the symbol."""
+        assert self.index.lookup("U1", "1", "renamed")["symbol"] == "AAA"
+        assert self.index.lookup("U1", "", "AAA")["conid"] == "1"
+        assert self.index.lookup("U2", "2", "BBB")["accountId"] == "U2"
+
+    def test_lookup_is_per_account(self):
+        """Checks that a position is only found in the account holding it."""
+        assert self.index.lookup("U2", "1", "AAA") is None
+        assert len(self.index) == 2
+
+    def test_lot_rows_are_skipped(self):
+        """Checks that LOT detail rows are not indexed, only the summary rows."""
+        self.index.add({"accountId": "U1", "conid": "3", "symbol": "CCC", "levelOfDetail": "LOT"})
+        assert self.index.lookup("U1", "3", "CCC") is None
+
+
+class TestYieldOnCost:
+    """Tests for the join of dividends and open positions parsed in the same pass."""
+
+    def setup_method(self):
+        self.positions = PositionIndex()
+        self.dividends = list(iter_dividends(STATEMENT, positions=self.positions))
+
+    def test_positions_collected_while_streaming(self):
+        """Tests that open positions are indexed in the same pass as the dividends."""
+        assert len(self.dividends) == 3
+        assert len(self.positions) == 2
+        assert self.positions.lookup("U1", "265598", "AAPL")["costBasisMoney"] == 20000
+        assert {d["accountId"] for d in self.dividends} == {"U1"}
+
+    def test_yield_on_cost_counts_each_payment_once(self):
+        """Tests the yield on cost when a payment appears as accrual and cash transaction."""
+        summary = _aggregate_dividends(self.dividends, self.positions, {"AAPL": 4})
+        aapl = next(p for p in summary["positions"] if p["ticker"] == "AAPL")
+        # Accrual and cash transaction of the same payment: 50 USD once, on a 20000 USD cost
+        assert aapl["payments"] == 1
+        assert aapl["dividends_eur"] == 45.0
+        assert aapl["cost_basis_eur"] == 18000.0
+        assert aapl["yield_on_cost"] == pytest.approx(0.0025)
+        assert aapl["annualized_yield"] == pytest.approx(0.01)
+
+    def test_positions_of_other_accounts_do_not_match(self):
+        """Checks that a dividend is not joined with a position of another account."""
+        # O is held in U2, but the dividend was paid in U1
+        summary = _aggregate_dividends(self.dividends, self.positions)
+        assert [p["ticker"] for p in summary["positions"]] == ["AAPL"]
+        assert summary["positions"][0]["annualized_yield"] is None
+
+    def test_without_positions(self):
+        """Checks that no yields are computed without open positions."""
+        assert _aggregate_dividends(self.dividends)["positions"] == []
+
+    def test_email_shows_yield_on_cost(self):
+        """Tests that the email shows the yield on cost section only when positions are given."""
+        summary = _aggregate_dividends(self.dividends, self.positions, {"AAPL": 4})
+        html_content = _create_html_content(self.dividends, "July 15, 2025", summary)
+        assert "Yield on Cost" in html_content
+        assert "0.25%" in html_content
+        assert "1.00%" in html_content
+        assert "Yield on Cost" not in _create_html_content(self.dividends, "July 15, 2025")
@@ -0,0 +1,46 @@
+# tests/test_profiler.py
+
+import os
+
+import profiler
+from profiler import enable_profiling, disable_profiling, profile_stage
+
+
+class TestProfileStage:
+    """Tests for the per-stage profiling helpers."""
+
+    def teardown_method(self):
+        disable_profiling()
+
+    def test_profile_stage_is_noop_when_disabled(self):
+        """Checks that stages share a no-op context when profiling is off."""
+        assert profile_stage("fetch") is profile_stage("parse")
+        with profile_stage("fetch"):
+            pass
+        assert profiler._active_profiler is None
+
+    def test_profile_stage_writes_stats_and_allocations(self, tmp_path):
+        """Checks that each stage writes a .pstats file and its top allocation sites."""
+        active = enable_profiling(str(tmp_path))
+
+        with profile_stage("parse"):
+            data = [str(i) * 10 for i in range(10000)]
+        with profile_stage("render"):
+            "".join(data)
+
+        assert [r["stage"] for r in active.results] == ["parse", "render"]
+        for result in active.results:
+            assert os.path.exists(result["stats_file"])
+            assert os.path.exists(result["allocations_file"])
+        assert "parse" in active.summary()
+        assert "render" in active.summary()
+
+    def test_nested_stages_are_folded_into_outer(self, tmp_path):
+        """Checks that a stage started inside another one is not profiled separately."""
+        active = enable_profiling(str(tmp_path))
+
+        with profile_stage("render"):
+            with profile_stage("aggregate"):
+                pass
+
+        assert [r["stage"] for r in active.results] == ["render"]
@@ -0,0 +1,74 @@
+# tests/test_rate_limiter.py
+
+import pytest
+from unittest.mock import patch
+
+from rate_limiter import FlexRateLimiter
+
+
+class TestFlexRateLimiter:
+    """Tests for the SQLite-backed token bucket shared across processes."""
+
+    def test_burst_is_granted_without_waiting(self, tmp_path):
+        """Checks that requests within the burst do not wait."""
+        limiter = FlexRateLimiter("token", requests_per_minute=60, burst=3, db_path=str(tmp_path / "rl.db"))
+
+        assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.wait_stats()["waits"] == 0
+
+    def test_try_acquire_does_not_wait(self, tmp_path):
+        """Checks that try_acquire takes a free slot and refuses without waiting when the bucket is empty."""
+        limiter = FlexRateLimiter("token", requests_per_minute=60, burst=1, db_path=str(tmp_path / "rl.db"))
+
+        assert limiter.try_acquire() is True
+        assert limiter.try_acquire() is False
+        assert limiter.wait_stats()["waits"] == 0
+
+    def test_only_recent_waits_are_kept(self, tmp_path):
+        """Checks that the waits table is pruned to the most recent waits per token."""
+        limiter = FlexRateLimiter("token", requests_per_minute=6000, burst=1, db_path=str(tmp_path / "rl.db"),
+                                  wait_window=2)
+
+        for _ in range(5):
+            limiter.acquire()
+
+        assert limiter.wait_stats()["waits"] == 2
+        assert limiter.conn.execute("SELECT COUNT(*) FROM waits").fetchone()[0] == 2
+
+    @patch('rate_limiter.time.sleep')
+    def test_budget_is_shared_between_instances(self, mock_sleep, tmp_path):
+        """Checks that two limiters on the same file and token share one bucket and record the wait."""
+        db_path = str(tmp_path / "rl.db")
+        first = FlexRateLimiter("token", requests_per_minute=60, burst=1, db_path=db_path)
+        second = FlexRateLimiter("token", requests_per_minute=60, burst=1, db_path=db_path)
+        other_token = FlexRateLimiter("other", requests_per_minute=60, burst=1, db_path=db_path)
+
+        assert first.acquire() == 0.0
+        assert other_token.acquire() == 0.0
+
+        # The bucket is empty; pretend a second passes while sleeping
+        clock = [1000.0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        with patch('rate_limiter.time.time', side_effect=lambda: clock[0]):
+            second.conn.execute("UPDATE buckets SET updated_at = ? WHERE key = ?", (clock[0], second.key))
+            waited = second.acquire()
+
+        assert waited == pytest.approx(1.0)
+        assert first.wait_stats()["waits"] == 1
+        assert first.wait_stats()["total_wait"] == pytest.approx(1.0)
+
+    def test_penalize_blocks_all_callers(self, tmp_path):
+        """Checks that a throttling backoff is seen by every instance with the same token."""
+        db_path = str(tmp_path / "rl.db")
+        first = FlexRateLimiter("token", requests_per_minute=600, burst=5, db_path=db_path)
+        second = FlexRateLimiter("token", requests_per_minute=600, burst=5, db_path=db_path)
+
+        assert first.penalize(0, base_delay=5.0) == 5.0
+        assert second._reserve() == pytest.approx(5.0, abs=0.5)
+
+    def test_penalize_backoff_is_exponential_and_capped(self, tmp_path):
+        """Tests that the throttling penalty doubles with each retry up to the maximum delay."""
+        limiter = FlexRateLimiter("token", db_path=str(tmp_path / "rl.db"))
+
+        assert limiter.penalize(2, base_delay=5.0) == 20.0
+        assert limiter.penalize(10, base_delay=5.0, max_delay=120.0) == 120.0
@@ -0,0 +1,77 @@
+# tests/test_reindex.py
+
+import pytest
+
+from dividend_store import DividendStore
+from load_test import build_statement
+from reindex import parse_archived_statement, reindex_statements
+from statement_archive import StatementArchive
+from tests import make_dividend
+
+
+class TestReindex:
+    """Tests for the parallel reindex of the archived statements."""
+
+    def setup_method(self):
+        self.store = DividendStore(":memory:")
+
+    def teardown_method(self):
+        self.store.close()
+
+    @pytest.fixture
+    def archive(self, tmp_path):
+        archive = StatementArchive(str(tmp_path))
+        archive.save("123", build_statement("U1", 40))
+        archive.save("123", build_statement("U2", 40))
+        return archive
+
+    def test_parse_archived_statement(self, archive):
+        """Tests that an archived statement is parsed through the memory map."""
+        path, records = parse_archived_statement(archive.paths()[0])
+        assert path == archive.paths()[0]
+        assert len(records) == 40
+
+    def test_parse_empty_statement(self, tmp_path):
+        """Checks that an empty archived file yields no records instead of failing."""
+        path = tmp_path / "123_empty.xml"
+        path.write_bytes(b"")
+        assert parse_archived_statement(str(path)) == (str(path), [])
+
+    def test_reindex_loads_store_and_calendar(self, archive):
+        """Tests that the records of every statement are loaded and the calendar recomputed."""
+        results = reindex_statements(archive, self.store, workers=2, batch_size=25)
+        assert results["statements"] == 2
+        assert results["failed"] == 0
+        assert results["parsed"] == 80
+        assert results["inserted"] > 0
+        assert self.store.tickers()
+        assert self.store.conn.execute("SELECT COUNT(*) FROM dividend_calendar").fetchone()[0] == len(self.store.tickers())
+
+    def test_reindex_is_idempotent(self, archive):
+        """Checks that reindexing the same statements twice inserts nothing new."""
+        first = reindex_statements(archive, self.store, workers=2)
+        second = reindex_statements(archive, self.store, workers=2)
+        assert second["parsed"] == first["parsed"]
+        assert second["inserted"] == 0
+
+    def test_rebuild_clears_history(self, archive):
+        """Tests that a rebuild replaces the records that are not in the archive."""
+        self.store.add_dividends([make_dividend("OLD", "2020-01-01")])
+        reindex_statements(archive, self.store, workers=2, rebuild=True)
+        assert "OLD" not in self.store.tickers()
+
+    def test_failed_rebuild_keeps_history(self, archive):
+        """Checks that a rebuild with an unparseable statement is rolled back, keeping the previous history."""
+        self.store.add_dividends([make_dividend("OLD", "2020-01-01")])
+        archive.save("123", "<FlexQueryResponse><FlexStatements>")
+
+        with pytest.raises(Exception, match="not rebuilt"):
+            reindex_statements(archive, self.store, workers=2, batch_size=10, rebuild=True)
+        assert self.store.tickers() == ["OLD"]
+
+    def test_corrupt_statement_is_counted(self, archive):
+        """Checks that an unparseable statement is counted and the others are still loaded."""
+        archive.save("123", "<FlexQueryResponse><FlexStatements>")
+        results = reindex_statements(archive, self.store, workers=2)
+        assert results["failed"] == 1
+        assert results["parsed"] == 80
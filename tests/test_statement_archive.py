@@ -0,0 +1,39 @@
+# tests/test_statement_archive.py
+
+from statement_archive import StatementArchive
+
+
+class TestStatementArchive:
+    """Tests for the lookup of archived Flex statements."""
+
+    def test_latest_statement_of_query(self, tmp_path):
+        """Tests that the most recent statement of the query is returned with its save time."""
+        archive = StatementArchive(str(tmp_path))
+        archive.save("123", "<first />")
+        newest = archive.save("123", "<second />")
+
+        path, saved_at = archive.latest("123")
+        assert path == newest
+        assert saved_at.strftime("%Y%m%dT%H%M%S%f") in path
+        assert archive.latest("456") is None
+
+    def test_stray_files_are_skipped(self, tmp_path):
+        """Checks that files not written by the archive are ignored instead of failing the lookup."""
+        archive = StatementArchive(str(tmp_path))
+        saved = archive.save("123", "<statement />")
+        (tmp_path / "123_backup.xml").write_text("<old />")
+        (tmp_path / "notes.xml").write_text("<notes />")
+
+        assert archive.latest("123")[0] == saved
+        assert archive.paths() == [saved]
+
+    def test_queries_sharing_a_prefix_are_kept_apart(self, tmp_path):
+        """Checks that the statements of query "123_4" are not taken for those of query "123"."""
+        archive = StatementArchive(str(tmp_path))
+        own = archive.save("123", "<own />")
+        other = archive.save("123_4", "<other />")
+
+        assert archive.paths("123") == [own]
+        assert archive.latest("123")[0] == own
+        assert archive.latest("123_4")[0] == other
+        assert sorted(archive.paths()) == sorted([own, other])
@@ -0,0 +1,104 @@
+import logging
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_DB_PATH = os.path.join("data", "watermarks.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    query_id TEXT PRIMARY KEY,
+    to_date TEXT NOT NULL,
+    when_generated TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+def _parse_flex_date(value: str) -> Optional[date]:
+    """Parses Flex dates (YYYYMMDD or YYYYMMDD;HHMMSS); None if empty or invalid."""
+    try:
+        return datetime.strptime((value or "").split(";")[0], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def completed_through(statements: Iterable[Dict]) -> Optional[date]:
+    """
+    Returns the last day fully covered by every FlexStatement of a response.
+    A statement generated on its own `toDate` may still miss rows of that day,
+    so the watermark stops the day before.
+
+    Args:
+        statements (Iterable[Dict]): FlexStatement attributes (toDate, whenGenerated).
+
+    Returns:
+        Optional[date]: None if no statement has a usable period.
+    """
+    days = []
+    for statement in statements:
+        to_date = _parse_flex_date(statement.get("toDate"))
+        if to_date is None:
+            continue
+        generated = _parse_flex_date(statement.get("whenGenerated"))
+        if generated is not None and generated <= to_date:
+            to_date = generated - timedelta(days=1)
+        days.append(to_date)
+    return min(days) if days else None
+
+
+class FlexWatermarks:
+    """
+    Last statement period processed per Flex query, so the next run only
+    requests the days after it instead of the whole configured period.
+
+    Args:
+        db_path (str): Path of the database file; the directory is created if needed.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv("IBKR_WATERMARK_DB", DEFAULT_DB_PATH)
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, query_id: str) -> Optional[date]:
+        row = self.conn.execute("SELECT to_date FROM watermarks WHERE query_id = ?", (query_id,)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def advance(self, query_id: str, to_date: date, when_generated: str = ""):
+        """Moves the watermark forward; an older period never moves it back."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO watermarks (query_id, to_date, when_generated, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(query_id) DO UPDATE SET to_date = excluded.to_date, "
+                "when_generated = excluded.when_generated, updated_at = excluded.updated_at "
+                "WHERE excluded.to_date > watermarks.to_date",
+                (query_id, to_date.isoformat(), when_generated, datetime.now().isoformat(timespec="seconds")),
+            )
+        logging.getLogger(__name__).info(f"Watermark of query {query_id} at {to_date.isoformat()}")
+
+    def delta_window(self, query_id: str, today: date = None) -> Optional[Tuple[date, date]]:
+        """
+        Returns the (from, to) dates to request for a query, or None to use
+        the period configured in the Flex Query (no watermark yet). The window
+        ends yesterday, the last complete day, so a day is never requested
+        while it can still change. `from` is after `to` when there is nothing
+        new to request.
+        """
+        watermark = self.get(query_id)
+        if watermark is None:
+            return None
+        return watermark + timedelta(days=1), (today or date.today()) - timedelta(days=1)